@@ -8,6 +8,7 @@ import os
 import sys
 import subprocess
 import json
+import hashlib
 import platform
 from pathlib import Path
 
@@ -41,12 +42,29 @@ def run_command(command, shell=False):
         print(f"Error: {e}")
         return False
 
-def write_yaml_config(config_file, config_data):
-    """Write YAML configuration after dependencies are installed."""
-    # This function will be called from the activated virtual environment
-    # where PyYAML is available
-    yaml_cmd = f"python -c \"import yaml; open('{config_file}', 'w').write(yaml.dump({config_data}, default_flow_style=False))\""
-    return yaml_cmd
+def venv_python_path(venv_name):
+    """Return the path of the Python interpreter inside the virtual environment."""
+    if platform.system() == "Windows":
+        return Path(venv_name) / "Scripts" / "python.exe"
+    return Path(venv_name) / "bin" / "python"
+
+def write_yaml_config(venv_python, config_file, config_data):
+    """Build the command that writes the YAML configuration using the venv's PyYAML."""
+    # The config is passed as a JSON argument, so no shell quoting is involved
+    script = (
+        "import json, sys, yaml; "
+        "open(sys.argv[1], 'w').write(yaml.dump(json.loads(sys.argv[2]), default_flow_style=False))"
+    )
+    return [str(venv_python), "-c", script, str(config_file), json.dumps(config_data)]
+
+def install_key():
+    """Hash the packaging metadata that determines what `pip install -e .` installs."""
+    digest = hashlib.blake2b()
+    for name in ("pyproject.toml", "setup.py"):
+        path = Path(name)
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
 
 def setup_project():
     """Set up the VPS-IBR project environment."""
@@ -67,20 +85,23 @@ def setup_project():
         if not run_command([sys.executable, "-m", "venv", venv_name]):
             return False
     
-    # Install dependencies
+    # Install dependencies; the venv's interpreter installs into the venv
+    # directly, so no shell or activation script is needed
     print_step("Installing dependencies")
-    if platform.system() == "Windows":
-        pip_cmd = f"{venv_name}\\Scripts\\pip"
-        activate_cmd = f"{venv_name}\\Scripts\\activate"
-        cmd = f"{activate_cmd} && pip install --upgrade pip && pip install -e ."
-    else:
-        pip_cmd = f"{venv_name}/bin/pip"
-        activate_cmd = f"source {venv_name}/bin/activate"
-        cmd = f"bash -c '{activate_cmd} && pip install --upgrade pip && pip install -e .'"
+    venv_python = venv_python_path(venv_name)
     
-    if not run_command(cmd, shell=True):
-        print("Failed to install dependencies")
-        return False
+    # The install is editable, so it only needs redoing when the packaging
+    # metadata changes
+    key = install_key()
+    key_file = Path(venv_name) / ".vps_ibr_install_key"
+    if key_file.exists() and key_file.read_text().strip() == key:
+        print("Dependencies are up to date")
+    else:
+        if not (run_command([str(venv_python), "-m", "pip", "install", "--upgrade", "pip"])
+                and run_command([str(venv_python), "-m", "pip", "install", "-e", "."])):
+            print("Failed to install dependencies")
+            return False
+        key_file.write_text(key)
     
     # Set up config directory
     print_step("Setting up configuration")
@@ -96,17 +117,11 @@ def setup_project():
             print(f"Created configuration from example: {config_file}")
         else:
             # Generate YAML config file using Python with PyYAML inside the virtual environment
-            if platform.system() == "Windows":
-                yaml_cmd = f"{activate_cmd} && " + write_yaml_config(config_file, SERVER_CONFIG)
-            else:
-                yaml_cmd = f"bash -c '{activate_cmd} && " + write_yaml_config(config_file, SERVER_CONFIG) + "'"
-            
-            if not run_command(yaml_cmd, shell=True):
+            if not run_command(write_yaml_config(venv_python, config_file, SERVER_CONFIG)):
                 # Fallback: write a JSON file if YAML fails
                 with open(config_dir / "servers_config.json", 'w') as f:
                     json.dump(SERVER_CONFIG, f, indent=2)
                 print(f"Created basic configuration as JSON: {config_dir / 'servers_config.json'}")
-                print("Note: You'll need to convert this to YAML format manually")
             else:
                 print(f"Created basic configuration: {config_file}")
     
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the backup module.
+"""
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vps_ibr.backup.manager import backup_user_homes, format_size
+
+class TestBackupManager(unittest.TestCase):
+    """Tests for the backup manager module."""
+
+    def test_format_size(self):
+        """Test formatting byte counts as human-readable sizes."""
+        self.assertEqual(format_size(0), "0 B")
+        self.assertEqual(format_size(1023), "1023.00 B")
+        self.assertEqual(format_size(1024), "1.00 KB")
+        self.assertEqual(format_size(1536), "1.50 KB")
+        self.assertEqual(format_size(3 * 1024 ** 3), "3.00 GB")
+        self.assertEqual(format_size(5 * 1024 ** 5), "5.00 PB")
+
+        # Sizes beyond the largest unit stay in that unit
+        self.assertEqual(format_size(2 * 1024 ** 6), "2048.00 PB")
+
+    @patch('vps_ibr.backup.manager.rsync_pull')
+    @patch('vps_ibr.backup.manager.run_ssh_command')
+    def test_backup_user_homes_bwlimit(self, mock_run, mock_rsync):
+        """Test that home directory transfers get the bandwidth limit."""
+        mock_run.return_value = "user1:/home/user1\nuser2:/srv/user2-home"
+
+        with tempfile.TemporaryDirectory() as server_dir, patch('builtins.print'):
+            backup_user_homes("192.0.2.10", "/tmp/id_test", server_dir, "5m", 2)
+
+        self.assertEqual(mock_rsync.call_count, 2)
+        for call in mock_rsync.call_args_list:
+            self.assertEqual(call.kwargs['bwlimit'], "5m")
+            self.assertEqual(call.kwargs['compress'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
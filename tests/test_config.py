@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the configuration module.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vps_ibr import config
+
+class TestLoadConfig(unittest.TestCase):
+    """Tests for loading and caching configuration files."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.dir.name, "servers.yaml")
+        self._write('servers:\n  - ip: "192.0.2.10"\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _write(self, content, mtime_ns=None):
+        """Write the configuration file, optionally with a given modification time."""
+        with open(self.config_path, 'w') as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(self.config_path, ns=(mtime_ns, mtime_ns))
+
+    def test_cache_miss_parses_and_stores(self):
+        """Test that the first load parses the file and writes the cache."""
+        result = config.load_config(self.config_path)
+        
+        self.assertEqual(result["servers"], [{"ip": "192.0.2.10"}])
+        self.assertEqual(result["global"]["timeout"], 30)
+        with open(config._cache_path(self.config_path)) as f:
+            cache = json.load(f)
+        self.assertEqual(cache["key"][:2], [config.__version__, config.CACHE_SCHEMA_VERSION])
+        # Defaults are applied on load, not stored in the cache
+        self.assertEqual(cache["config"], {"servers": [{"ip": "192.0.2.10"}]})
+
+    def test_cache_hit_skips_parsing(self):
+        """Test that an unchanged file is loaded from the cache and still validated."""
+        config.load_config(self.config_path)
+        
+        with patch('vps_ibr.config.yaml.load') as mock_load:
+            result = config.load_config(self.config_path)
+        
+        mock_load.assert_not_called()
+        self.assertEqual(result["servers"], [{"ip": "192.0.2.10"}])
+        self.assertEqual(result["global"]["timeout"], 30)
+
+    def test_cache_invalidated_by_file_change(self):
+        """Test that a modified file is parsed again."""
+        self._write('servers:\n  - ip: "192.0.2.10"\n', mtime_ns=1_000_000_000)
+        config.load_config(self.config_path)
+        
+        self._write('servers:\n  - ip: "192.0.2.20"\n', mtime_ns=2_000_000_000)
+        result = config.load_config(self.config_path)
+        
+        self.assertEqual(result["servers"], [{"ip": "192.0.2.20"}])
+
+    def test_cache_invalidated_by_package_version(self):
+        """Test that a cache written by another package version is ignored."""
+        config.load_config(self.config_path)
+        
+        with patch('vps_ibr.config.__version__', "0.0.0-other"):
+            other = {"servers": [{"ip": "192.0.2.30"}]}
+            with patch('vps_ibr.config.yaml.load', return_value=other) as mock_load:
+                result = config.load_config(self.config_path)
+        
+        mock_load.assert_called_once()
+        self.assertEqual(result["servers"], [{"ip": "192.0.2.30"}])
+
+    def test_cached_config_is_validated(self):
+        """Test that an invalid cached configuration is rejected."""
+        config.load_config(self.config_path)
+        cache_path = config._cache_path(self.config_path)
+        with open(cache_path) as f:
+            cache = json.load(f)
+        cache["config"] = {"servers": [{"description": "no ip"}]}
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+        
+        with patch('builtins.print'):
+            self.assertIsNone(config.load_config(self.config_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,27 +5,30 @@ Unit tests for the inventory module.
 import os
 import tempfile
 import unittest
-from unittest.mock import patch, MagicMock
+from pathlib import Path
+from unittest.mock import MagicMock
 
-from vps_ibr.inventory.collector import get_users, get_sudo_users, copy_bash_history
-from vps_ibr.inventory.parser import parse_bash_history
+from vps_ibr.inventory.collector import (
+    get_users, get_sudo_users, copy_bash_history, parse_combined_output
+)
+from vps_ibr.inventory.parser import analyze_server_history_fused, parse_bash_history
 # from vps_ibr.utils.file_utils import ensure_dir, save_json  # In backup/manager.py
 # from vps_ibr.utils.file_utils import ensure_dir, load_json  # In restore/manager.py
 
 class TestInventoryCollector(unittest.TestCase):
     """Tests for the inventory collector module."""
 
-    @patch('vps_ibr.utils.ssh.run_ssh_command')
-    def test_get_users(self, mock_run_ssh_command):
+    def test_get_users(self):
         """Test getting users from a server."""
         # Mock SSH command output
-        mock_run_ssh_command.return_value = (
+        session = MagicMock()
+        session.run.return_value = (
             "user1:/home/user1\n"
             "user2:/home/user2\n"
         )
         
         # Call function
-        users = get_users('192.0.2.10', '/path/to/key')
+        users = get_users(session)
         
         # Check results
         self.assertEqual(len(users), 3)  # 2 regular users + root
@@ -37,23 +40,21 @@ class TestInventoryCollector(unittest.TestCase):
         self.assertEqual(users[2]['home'], '/root')
         
         # Verify SSH command
-        mock_run_ssh_command.assert_called_once()
-        args, _ = mock_run_ssh_command.call_args
-        self.assertEqual(args[0], '192.0.2.10')
-        self.assertEqual(args[1], '/path/to/key')
-        self.assertIn('awk', args[2])
+        session.run.assert_called_once()
+        args, _ = session.run.call_args
+        self.assertIn('awk', args[0])
 
-    @patch('vps_ibr.utils.ssh.run_ssh_command')
-    def test_get_sudo_users(self, mock_run_ssh_command):
+    def test_get_sudo_users(self):
         """Test getting sudo users from a server."""
         # Mock SSH command outputs
-        mock_run_ssh_command.side_effect = [
+        session = MagicMock()
+        session.run.side_effect = [
             "user1,user2",  # Output from sudo group
             "user3"         # Output from sudoers file
         ]
         
         # Call function
-        sudo_users = get_sudo_users('192.0.2.10', '/path/to/key')
+        sudo_users = get_sudo_users(session)
         
         # Check results
         self.assertEqual(len(sudo_users), 3)
@@ -62,17 +63,33 @@ class TestInventoryCollector(unittest.TestCase):
         self.assertIn('user3', sudo_users)
         
         # Verify SSH commands
-        self.assertEqual(mock_run_ssh_command.call_count, 2)
+        self.assertEqual(session.run.call_count, 2)
+
+    def test_parse_combined_output(self):
+        """Test splitting the combined inventory script output."""
+        output = (
+            b"\0SECTION:users\0user1:/home/user1\n"
+            b"\0SECTION:sudo_group\0user1\n"
+            b"\0SECTION:sudoers\0%admin\nuser2\n"
+        )
+        
+        users, sudo_users = parse_combined_output(output)
+        
+        self.assertEqual([u['username'] for u in users], ['user1', 'root'])
+        self.assertEqual(users[0]['home'], '/home/user1')
+        self.assertEqual(sorted(sudo_users), ['user1', 'user2'])
 
     def test_parse_bash_history(self):
         """Test parsing bash history."""
         # Create a temporary bash history file
         with tempfile.NamedTemporaryFile(mode='w+', delete=False) as f:
-            f.write("apt-get update\n")
-            f.write("apt-get install nginx\n")
-            f.write("systemctl start nginx\n")
-            f.write("useradd -m testuser\n")
             history_file = f.name
+        Path(history_file).write_text(
+            "apt-get update\n"
+            "apt-get install nginx\n"
+            "systemctl start nginx\n"
+            "useradd -m testuser\n"
+        )
         
         try:
             # Parse the history file
@@ -87,5 +104,63 @@ class TestInventoryCollector(unittest.TestCase):
             # Clean up the temporary file
             os.unlink(history_file)
 
+    def test_parse_bash_history_mixed_commands(self):
+        """Test commands chained after docker run on the same line."""
+        with tempfile.NamedTemporaryFile(mode='w+', delete=False) as f:
+            history_file = f.name
+        Path(history_file).write_text(
+            "docker run -v /a:/b foo:1 && apt install curl && docker pull y:2\n"
+            "docker run -d -p 80:80 nginx:latest; systemctl restart nginx\n"
+        )
+        
+        try:
+            result = parse_bash_history(history_file)
+            
+            self.assertEqual(result['packages']['apt'], ['curl'])
+            self.assertEqual(result['packages']['docker'], ['foo:1', 'y:2', 'nginx:latest'])
+            self.assertEqual(result['services'], ['nginx'])
+        finally:
+            os.unlink(history_file)
+
+    def test_fused_analysis_matches_per_file_parse(self):
+        """Test that the single-scan server analysis equals parsing each history on its own."""
+        histories = {
+            "alice": b"apt install -y nginx\nsystemctl enable nginx\nuseradd -m deploy\n",
+            # Ends without a newline, so the last command touches the next history
+            "bob": b"pip install requests\ndocker pull redis:7",
+            "carol": b"",
+            # Starts with a match right at the file boundary
+            "dave": b"service mysql restart\nnpm install -g pm2\ndocker pull redis:7\n",
+            # Home directory reached through a symlink
+            "erin": b"yum install -y httpd\n",
+        }
+        with tempfile.TemporaryDirectory() as server_dir:
+            for user, history in histories.items():
+                user_dir = os.path.join(server_dir, "users", user)
+                if user == "erin":
+                    target = os.path.join(server_dir, "shared", user)
+                    os.makedirs(target)
+                    os.symlink(target, user_dir)
+                else:
+                    os.makedirs(user_dir)
+                Path(user_dir, "bash_history").write_bytes(history)
+            
+            analysis = analyze_server_history_fused(server_dir)
+            expected = {
+                user: parse_bash_history(os.path.join(server_dir, "users", user, "bash_history"))
+                for user in histories
+            }
+        
+        self.assertEqual(analysis["by_user"], expected)
+        self.assertEqual(
+            analysis["by_user"]["carol"], {"packages": {}, "services": [], "users": []}
+        )
+        self.assertEqual(analysis["by_user"]["bob"]["packages"]["docker"], ["redis:7"])
+        self.assertEqual(analysis["by_user"]["dave"]["services"], ["mysql"])
+        self.assertEqual(analysis["packages"]["docker"], ["redis:7"])
+        self.assertEqual(analysis["services"], ["mysql", "nginx"])
+        self.assertEqual(analysis["users_created"], ["deploy"])
+        self.assertEqual(analysis["by_user"]["erin"]["packages"]["yum"], ["httpd"])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
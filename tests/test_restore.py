@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the restore module.
+"""
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vps_ibr.restore import manager
+from vps_ibr.restore.manager import restore_server
+
+class TestRestoreManager(unittest.TestCase):
+    """Tests for the restore manager module."""
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.backup_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.home.name, ".ssh"))
+        open(os.path.join(self.home.name, ".ssh", "id_test"), 'w').close()
+        os.makedirs(os.path.join(self.backup_dir.name, "system", "etc"))
+
+    def tearDown(self):
+        self.home.cleanup()
+        self.backup_dir.cleanup()
+
+    @patch('vps_ibr.restore.manager.close_mux')
+    @patch('vps_ibr.restore.manager.open_master_connection')
+    @patch('vps_ibr.restore.manager.rsync_push_many')
+    @patch('vps_ibr.restore.manager.run_ssh_command')
+    def test_restore_log_has_progress(self, mock_run, mock_rsync, mock_open, mock_close):
+        """Test that restore progress reaches the restore log at any logger level."""
+        mock_run.return_value = "SSH connection successful"
+        manager.logger.setLevel(logging.WARNING)
+        self.addCleanup(manager.logger.setLevel, logging.NOTSET)
+
+        with patch.dict(os.environ, {"HOME": self.home.name}), patch('builtins.print'):
+            self.assertTrue(restore_server(self.backup_dir.name, "192.0.2.10", "id_test"))
+
+        with open(os.path.join(self.backup_dir.name, "restore_log.txt")) as f:
+            log = f.read()
+        self.assertIn("Target server: 192.0.2.10", log)
+        self.assertIn("] Restoring system configurations\n", log)
+        self.assertIn("]   Restoring /etc directory\n", log)
+        self.assertIn("Restoration completed.", log)
+
+        # The caller's level and handlers are left as they were
+        self.assertEqual(manager.logger.level, logging.WARNING)
+        self.assertEqual(manager.logger.handlers, [])
+
+    @patch('vps_ibr.restore.manager.close_mux')
+    @patch('vps_ibr.restore.manager.open_master_connection')
+    @patch('vps_ibr.restore.manager.rsync_push_many')
+    @patch('vps_ibr.restore.manager.run_ssh_command')
+    def test_restore_progress_printed(self, mock_run, mock_rsync, mock_open, mock_close):
+        """Test that progress is printed when the application has not set up logging."""
+        mock_run.return_value = "SSH connection successful"
+
+        with patch.dict(os.environ, {"HOME": self.home.name}), \
+                patch.object(manager.logger, 'hasHandlers', return_value=False), \
+                patch('sys.stdout') as mock_stdout:
+            restore_server(self.backup_dir.name, "192.0.2.10", "id_test")
+
+        output = "".join(call.args[0] for call in mock_stdout.write.call_args_list)
+        self.assertIn("Restoring system configurations\n", output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the SSH utilities.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from vps_ibr.utils import ssh
+
+def _completed(returncode=0, stdout=b"", stderr=b""):
+    """Return a finished process result as subprocess.run would."""
+    return subprocess.CompletedProcess([], returncode, stdout, stderr)
+
+class TestRsync(unittest.TestCase):
+    """Tests for the rsync helpers."""
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_rsync_push_many_command(self, mock_run):
+        """Test the command line and file list of a multi-directory push."""
+        mock_run.return_value = _completed()
+        
+        result = ssh.rsync_push_many(
+            "127.0.0.1", "/tmp/id_test", "/backup/system", ["etc/", "var/spool/cron/"],
+            numeric_ids=False
+        )
+        
+        self.assertTrue(result)
+        mock_run.assert_called_once()
+        args, kwargs = mock_run.call_args
+        command = args[0]
+        self.assertTrue(command[0].endswith("rsync"))
+        self.assertIn("-r", command)
+        self.assertIn("--files-from=-", command)
+        # Parents of the listed paths must not be sent with the attributes
+        # of the local backup tree
+        self.assertIn("--no-implied-dirs", command)
+        self.assertNotIn("--numeric-ids", command)
+        self.assertEqual(command[-2:], ["/backup/system/", "root@127.0.0.1:/"])
+        self.assertEqual(kwargs['input'], b"etc/\nvar/spool/cron/\n")
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_rsync_pull_many_command(self, mock_run):
+        """Test the command line of a multi-directory pull."""
+        mock_run.return_value = _completed()
+        
+        result = ssh.rsync_pull_many("127.0.0.1", "/tmp/id_test", ["/etc/"], "/backup/system")
+        
+        self.assertTrue(result)
+        command = mock_run.call_args[0][0]
+        self.assertIn("--files-from=-", command)
+        self.assertIn("--no-implied-dirs", command)
+        self.assertEqual(command[-2:], ["root@127.0.0.1:/", "/backup/system"])
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_rsync_push_many_failure(self, mock_run):
+        """Test that a failed push is reported as False."""
+        mock_run.return_value = _completed(returncode=23, stderr=b"some files were not transferred")
+        
+        with self.assertLogs("vps_ibr.utils.ssh", level="ERROR"):
+            result = ssh.rsync_push_many("127.0.0.1", "/tmp/id_test", "/backup/system", ["etc/"])
+        
+        self.assertFalse(result)
+
+class TestResolve(unittest.TestCase):
+    """Tests for resolving server addresses."""
+
+    def setUp(self):
+        ssh._lookup.cache_clear()
+        self.addCleanup(ssh._lookup.cache_clear)
+
+    @patch('vps_ibr.utils.ssh.socket.getaddrinfo')
+    def test_failure_is_not_cached(self, mock_getaddrinfo):
+        """Test that a failed lookup falls back to the name and is tried again later."""
+        address = (ssh.socket.AF_INET, ssh.socket.SOCK_STREAM, 6, "", ("192.0.2.10", 22))
+        mock_getaddrinfo.side_effect = [OSError("Temporary failure in name resolution"), [address]]
+        
+        self.assertEqual(ssh._resolve("vps.example.com"), ("vps.example.com", "any"))
+        self.assertEqual(ssh._resolve("vps.example.com"), ("192.0.2.10", "inet"))
+        # Successful lookups are remembered
+        self.assertEqual(ssh._resolve("vps.example.com"), ("192.0.2.10", "inet"))
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+
+class TestMasterConnection(unittest.TestCase):
+    """Tests for sharing SSH master connections between callers."""
+
+    def _subcommands(self, mock_run):
+        """Return the -O control command, or "start", of each ssh call made."""
+        return [
+            command[command.index("-O") + 1] if "-O" in command else "start"
+            for command in (call.args[0] for call in mock_run.call_args_list)
+        ]
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_owned_master_closed_by_last_holder(self, mock_run):
+        """Test that a master started here is stopped only when its last holder releases it."""
+        mock_run.side_effect = [_completed(255), _completed()]
+        
+        ssh.open_master_connection("192.0.2.10", "/tmp/id_test")
+        ssh.open_master_connection("192.0.2.10", "/tmp/id_test")
+        self.assertEqual(self._subcommands(mock_run), ["check", "start"])
+        
+        mock_run.side_effect = None
+        mock_run.return_value = _completed()
+        ssh.close_mux("192.0.2.10")
+        self.assertEqual(self._subcommands(mock_run), ["check", "start"])
+        ssh.close_mux("192.0.2.10")
+        self.assertEqual(self._subcommands(mock_run), ["check", "start", "exit"])
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_foreign_master_left_running(self, mock_run):
+        """Test that a master started by another process or on demand is not stopped."""
+        mock_run.return_value = _completed()
+        
+        ssh.open_master_connection("192.0.2.10", "/tmp/id_test")
+        ssh.close_mux("192.0.2.10")
+        # Releasing a master that was never taken does nothing either
+        ssh.close_mux("192.0.2.10")
+        
+        self.assertEqual(self._subcommands(mock_run), ["check"])
+
+class TestRsyncOptions(unittest.TestCase):
+    """Tests for the rsync transfer and exclude options."""
+
+    def test_base_command_defaults(self):
+        """Test the flags every rsync call gets by default."""
+        command = ssh._rsync_base_command(True, None, True, False)
+        
+        self.assertTrue(command[0].endswith("rsync"))
+        for flag in ("-a", "--delete", "--no-motd", "-W", "--numeric-ids", "--partial"):
+            self.assertIn(flag, command)
+        self.assertIn(f"--partial-dir={ssh.RSYNC_PARTIAL_DIR}", command)
+        self.assertFalse(any(arg.startswith("--bwlimit") for arg in command))
+        self.assertNotIn("-z", command)
+
+    def test_base_command_options(self):
+        """Test the flags added or removed by each option."""
+        command = ssh._rsync_base_command(False, 2, True, True, "5m", False, ".partial")
+        
+        self.assertIn("--bwlimit=5m", command)
+        self.assertIn("--partial-dir=.partial", command)
+        self.assertIn("--compress-level=2", command)
+        self.assertIn("-v", command)
+        self.assertNotIn("-W", command)
+        self.assertNotIn("--numeric-ids", command)
+        
+        command = ssh._rsync_base_command(True, None, False, False)
+        self.assertNotIn("--partial", command)
+        self.assertFalse(any(arg.startswith("--partial-dir") for arg in command))
+
+    def test_short_exclude_list(self):
+        """Test that a few patterns are passed as --exclude arguments."""
+        with ssh._rsync_exclude_opts(["*.log", "cache/"], "/etc/vps-ibr/excludes") as opts:
+            self.assertEqual(opts, [
+                "--exclude", "*.log", "--exclude", "cache/",
+                "--exclude-from=/etc/vps-ibr/excludes"
+            ])
+
+    def test_long_exclude_list(self):
+        """Test that a long pattern list goes through a temporary file, removed afterwards."""
+        patterns = [f"dir{i}/" for i in range(ssh.MAX_EXCLUDE_ARGS + 1)]
+        with ssh._rsync_exclude_opts(patterns, None) as opts:
+            self.assertEqual(len(opts), 1)
+            self.assertTrue(opts[0].startswith("--exclude-from="))
+            exclude_file = opts[0].split("=", 1)[1]
+            with open(exclude_file) as f:
+                self.assertEqual(f.read().splitlines(), patterns)
+        
+        self.assertFalse(os.path.exists(exclude_file))
+
+    def test_long_exclude_list_removed_on_error(self):
+        """Test that the temporary exclude file is removed when the transfer fails."""
+        patterns = [f"dir{i}/" for i in range(ssh.MAX_EXCLUDE_ARGS + 1)]
+        with self.assertRaises(RuntimeError):
+            with ssh._rsync_exclude_opts(patterns, None) as opts:
+                exclude_file = opts[0].split("=", 1)[1]
+                raise RuntimeError("rsync failed")
+        
+        self.assertFalse(os.path.exists(exclude_file))
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_rsync_pull_options(self, mock_run):
+        """Test that rsync_pull passes its options to rsync."""
+        exclude_files = []
+        def rsync(command, **kwargs):
+            excludes = [
+                arg.split("=", 1)[1] for arg in command if arg.startswith("--exclude-from=")
+            ]
+            exclude_files.extend(excludes)
+            self.assertTrue(all(os.path.exists(path) for path in excludes))
+            return _completed()
+        mock_run.side_effect = rsync
+        patterns = [f"*.tmp{i}" for i in range(40)]
+        
+        result = ssh.rsync_pull(
+            "127.0.0.1", "/tmp/id_test", "/home/user/", "/backup/user", patterns,
+            bwlimit="10m", include=["*.conf"], numeric_ids=False, partial_dir=".part"
+        )
+        
+        self.assertTrue(result)
+        command = mock_run.call_args[0][0]
+        self.assertIn("--bwlimit=10m", command)
+        self.assertIn("--partial-dir=.part", command)
+        self.assertNotIn("--numeric-ids", command)
+        self.assertNotIn("*.tmp0", command)
+        # Excludes come first, then the includes and the catch-all exclude
+        exclude_from = command.index(f"--exclude-from={exclude_files[0]}")
+        self.assertLess(exclude_from, command.index("*.conf"))
+        self.assertEqual(
+            command[-4:], ["--exclude", "*", "root@127.0.0.1:/home/user/", "/backup/user"]
+        )
+        self.assertFalse(os.path.exists(exclude_files[0]))
+
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_rsync_push_options(self, mock_run):
+        """Test that rsync_push passes bwlimit and its exclude file to rsync."""
+        mock_run.return_value = _completed()
+        
+        ssh.rsync_push(
+            "127.0.0.1", "/tmp/id_test", "/backup/user/", "/home/user/", ["*.log"],
+            bwlimit="1m", exclude_from="/tmp/excludes"
+        )
+        
+        command = mock_run.call_args[0][0]
+        self.assertIn("--bwlimit=1m", command)
+        self.assertIn("--numeric-ids", command)
+        self.assertIn("--exclude-from=/tmp/excludes", command)
+        self.assertEqual(command[-2:], ["/backup/user/", "root@127.0.0.1:/home/user/"])
+
+class TestFilesTar(unittest.TestCase):
+    """Tests for copying several files in one tar stream."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.remote = os.path.join(self.dir.name, "remote")
+        self.local = os.path.join(self.dir.name, "local")
+        os.makedirs(self.remote)
+        for name in ("hosts", "passwd"):
+            with open(os.path.join(self.remote, name), 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _copy(self, script):
+        """Copy both files, with the server side of the stream run by a local shell script."""
+        popen = subprocess.Popen
+        
+        def fake_popen(command, **kwargs):
+            if command[0].endswith("ssh"):
+                command = ["sh", "-c", script]
+            return popen(command, **kwargs)
+        
+        with patch('vps_ibr.utils.ssh.subprocess.Popen', side_effect=fake_popen):
+            paths = [os.path.join(self.remote, "hosts"), os.path.join(self.remote, "passwd")]
+            return ssh.scp_get_files_tar("192.0.2.10", "/tmp/id_test", paths, self.local)
+
+    def test_copy_with_large_stderr(self):
+        """Test that a sender writing more than a pipe buffer to stderr does not hang."""
+        script = f"head -c 1000000 /dev/zero >&2; tar -cf - -C {self.remote} hosts passwd"
+        
+        self.assertTrue(self._copy(script))
+        
+        self.assertEqual(sorted(os.listdir(self.local)), ["hosts", "passwd"])
+        with open(os.path.join(self.local, "passwd")) as f:
+            self.assertEqual(f.read(), "passwd")
+
+    def test_failure_leaves_target_untouched(self):
+        """Test that files from a failed transfer are not left in the target directory."""
+        script = f"tar -cf - -C {self.remote} hosts passwd; echo 'tar: warning' >&2; exit 2"
+        
+        with self.assertLogs("vps_ibr.utils.ssh", level="ERROR") as logs:
+            self.assertFalse(self._copy(script))
+        
+        self.assertIn("tar: warning", logs.output[0])
+        self.assertEqual(os.listdir(self.local), [])
+
+class TestCappedOutput(unittest.TestCase):
+    """Tests for reading command output with a size limit."""
+
+    def _popen(self, code, stdin=None):
+        """Start a local Python process in place of ssh."""
+        return subprocess.Popen(
+            [sys.executable, "-c", code],
+            stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def test_output_over_limit_kills_command(self):
+        """Test that a command writing more than the limit is killed."""
+        code = (
+            "import sys, time\n"
+            "sys.stdout.write('x' * 100000)\nsys.stdout.flush()\ntime.sleep(60)"
+        )
+        for communicate in (ssh._communicate_capped, ssh._communicate_capped_threads):
+            with self.subTest(communicate=communicate.__name__):
+                with self._popen(code) as proc:
+                    self.assertIsNone(communicate(proc, None, 1000))
+                    self.assertNotEqual(proc.returncode, 0)
+
+    def test_input_is_written(self):
+        """Test that input is fed to the command's stdin."""
+        data = b"payload\n" * 100000
+        code = (
+            "import sys\n"
+            "data = sys.stdin.buffer.read()\nprint(len(data))\nsys.stderr.write('done')"
+        )
+        for communicate in (ssh._communicate_capped, ssh._communicate_capped_threads):
+            with self.subTest(communicate=communicate.__name__):
+                with self._popen(code, stdin=subprocess.PIPE) as proc:
+                    stdout, stderr = communicate(proc, data, ssh.MAX_OUTPUT_BYTES)
+                self.assertEqual(stdout.strip(), str(len(data)).encode())
+                self.assertEqual(stderr, b"done")
+
+    def test_run_ssh_argv_over_limit(self):
+        """Test that run_ssh_command's subprocess path returns None on too much output."""
+        argv = (sys.executable, "-c", "print('x' * 5000)")
+        with self.assertLogs("vps_ibr.utils.ssh", level="ERROR") as logs:
+            result = ssh._run_ssh_argv("127.0.0.1", argv, False, None, 1000)
+        self.assertIsNone(result)
+        self.assertIn("exceeded 1000 bytes", logs.output[0])
+
+    def test_run_ssh_argv_input(self):
+        """Test that run_ssh_command's subprocess path passes input and decodes output."""
+        argv = (sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read().upper())")
+        result = ssh._run_ssh_argv("127.0.0.1", argv, False, "echo hello\n", ssh.MAX_OUTPUT_BYTES)
+        self.assertEqual(result, "ECHO HELLO")
+
+class _FakeSFTPClient:
+    """Stand-in for an asyncssh SFTP client."""
+
+    def __init__(self, stall=False):
+        self.stall = stall
+
+    async def get(self, remote_path, local_path, progress_handler=None, **kwargs):
+        if self.stall:
+            await asyncio.sleep(3600)
+        with open(local_path, 'wb') as f:
+            f.write(b"content")
+        if progress_handler:
+            progress_handler(remote_path, local_path, 7, 7)
+
+    def exit(self):
+        pass
+
+def _fake_connection(sftp):
+    """Return a stand-in for an asyncssh connection serving sftp."""
+    conn = MagicMock()
+    conn.is_closed.return_value = False
+    conn.start_sftp_client = AsyncMock(return_value=sftp)
+    conn.wait_closed = AsyncMock()
+    return conn
+
+@unittest.skipIf(ssh.asyncssh is None, "asyncssh is not installed")
+class TestSFTPSessionCache(unittest.TestCase):
+    """Tests for the SFTP sessions scp_get_file keeps per server."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        os.environ.pop("VPS_IBR_USE_PARAMIKO", None)
+
+    def tearDown(self):
+        ssh.close_sftp_sessions()
+        self.dir.cleanup()
+
+    def _get(self, name, timeout=30):
+        return ssh.scp_get_file(
+            "192.0.2.10", "/tmp/id_test", "/etc/hosts", os.path.join(self.dir.name, name), timeout
+        )
+
+    def test_session_is_reused(self):
+        """Test that downloads from the same server share one connection."""
+        conn = _fake_connection(_FakeSFTPClient())
+        connect = AsyncMock(return_value=conn)
+        with patch('vps_ibr.utils.ssh.asyncssh.connect', connect) as mock_connect:
+            self.assertTrue(self._get("a"))
+            self.assertTrue(self._get("b"))
+        
+        mock_connect.assert_called_once()
+        with open(os.path.join(self.dir.name, "b"), 'rb') as f:
+            self.assertEqual(f.read(), b"content")
+
+    def test_stalled_session_is_evicted(self):
+        """Test that a stalled download times out and drops the cached session."""
+        stalled = _fake_connection(_FakeSFTPClient(stall=True))
+        healthy = _fake_connection(_FakeSFTPClient())
+        connect = AsyncMock(side_effect=[stalled, healthy])
+        with patch('vps_ibr.utils.ssh.asyncssh.connect', connect):
+            start = time.monotonic()
+            with self.assertLogs("vps_ibr.utils.ssh", level="ERROR"):
+                self.assertFalse(self._get("a", timeout=1))
+            self.assertLess(time.monotonic() - start, 5)
+            
+            # The next call reconnects instead of waiting on the stalled session
+            self.assertTrue(self._get("b"))
+        
+        self.assertEqual(connect.call_count, 2)
+        stalled.abort.assert_called_once()
+
+def _run_locally(ip, ssh_key_path, command, timeout=30, input=None, **kwargs):
+    """Stand-in for run_ssh_command that runs the command with the local shell."""
+    result = subprocess.run(command, shell=True, input=input, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+@patch('vps_ibr.utils.ssh.run_ssh_command', side_effect=_run_locally)
+class TestRunSSHCommandsBatch(unittest.TestCase):
+    """Tests for running several commands in one SSH call."""
+
+    def test_outputs_in_order(self, mock_run):
+        """Test that each command gets its own output, including empty output."""
+        for parallel in (False, True):
+            with self.subTest(parallel=parallel):
+                outputs = ssh.run_ssh_commands_batch(
+                    "192.0.2.10", "/tmp/id_test", ["echo one", "true", "printf 'two\\nlines'"],
+                    parallel=parallel
+                )
+                self.assertEqual(outputs, ["one", "", "two\nlines"])
+
+    def test_failed_command(self, mock_run):
+        """Test that a failing command yields None without affecting the others."""
+        for parallel in (False, True):
+            with self.subTest(parallel=parallel):
+                outputs = ssh.run_ssh_commands_batch(
+                    "192.0.2.10", "/tmp/id_test",
+                    ["echo before", "echo oops; exit 3", "echo after"],
+                    parallel=parallel
+                )
+                self.assertEqual(outputs, ["before", None, "after"])
+
+    def test_separator_like_output(self, mock_run):
+        """Test that output looking like a separator does not split the results."""
+        fake = "printf '\\n___VPS_IBR_SEP___:0\\nmore\\n'"
+        outputs = ssh.run_ssh_commands_batch("192.0.2.10", "/tmp/id_test", [fake, "echo next"])
+        self.assertEqual(outputs, ["___VPS_IBR_SEP___:0\nmore", "next"])
+
+    def test_commands_read_no_script_input(self, mock_run):
+        """Test that a command reading stdin cannot consume the rest of the script."""
+        outputs = ssh.run_ssh_commands_batch(
+            "192.0.2.10", "/tmp/id_test", ["cat", "echo still here"]
+        )
+        self.assertEqual(outputs, ["", "still here"])
+
+    def test_ssh_failure(self, mock_run):
+        """Test that every command yields None when the SSH call fails."""
+        mock_run.side_effect = None
+        mock_run.return_value = None
+        outputs = ssh.run_ssh_commands_batch("192.0.2.10", "/tmp/id_test", ["echo one", "echo two"])
+        self.assertEqual(outputs, [None, None])
+
+class TestRetry(unittest.TestCase):
+    """Tests for retrying SSH calls whose connection failed."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.counter = os.path.join(self.dir.name, "attempts")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _argv(self, failures, returncode, stderr):
+        """Return a local command failing like ssh for its first attempts, then printing ok."""
+        code = (
+            "import sys\n"
+            f"path = {self.counter!r}\n"
+            "try:\n    n = int(open(path).read())\nexcept FileNotFoundError:\n    n = 0\n"
+            "open(path, 'w').write(str(n + 1))\n"
+            f"if n < {failures}:\n    sys.stderr.write({stderr!r})\n    sys.exit({returncode})\n"
+            "print('ok')\n"
+        )
+        return (sys.executable, "-c", code)
+
+    def _attempts(self):
+        with open(self.counter) as f:
+            return int(f.read())
+
+    def test_is_transient(self):
+        """Test which failures count as transient."""
+        self.assertTrue(
+            ssh._is_transient(255, b"ssh: connect to host 192.0.2.10 port 22: Connection refused")
+        )
+        self.assertTrue(
+            ssh._is_transient(255, b"kex_exchange_identification: Connection closed by remote host")
+        )
+        self.assertTrue(ssh._is_transient(255, b"Connection closed by 192.0.2.10 port 22"))
+        self.assertFalse(ssh._is_transient(255, b"root@192.0.2.10: Permission denied (publickey)."))
+        self.assertFalse(ssh._is_transient(255, b"Host key verification failed."))
+        self.assertFalse(ssh._is_transient(
+            255, b"ssh: Could not resolve hostname nowhere: Name or service not known"
+        ))
+        self.assertFalse(ssh._is_transient(1, b"Connection refused"))
+        
+        # A remote command exiting with 255, or a connection dropped after the
+        # command started, may have had effects and is not run again
+        self.assertFalse(ssh._is_transient(255, b""))
+        self.assertFalse(ssh._is_transient(255, b"ERROR 2002: Can't connect: Connection refused"))
+        self.assertFalse(ssh._is_transient(255, b"Connection to 192.0.2.10 closed by remote host."))
+        self.assertFalse(ssh._is_transient(255, b"client_loop: send disconnect: Broken pipe"))
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    def test_transient_failure_is_retried(self, mock_sleep):
+        """Test that a connection failure is retried with backoff until it succeeds."""
+        argv = self._argv(2, 255, "ssh: connect to host 192.0.2.10 port 22: Connection refused")
+        with self.assertLogs("vps_ibr.utils.ssh", level="WARNING"):
+            result = ssh._run_ssh_argv("192.0.2.10", argv, False, None, ssh.MAX_OUTPUT_BYTES)
+        
+        self.assertEqual(result, "ok")
+        self.assertEqual(self._attempts(), 3)
+        self.assertEqual(
+            [c.args[0] for c in mock_sleep.call_args_list], list(ssh.RETRY_BACKOFF[:2])
+        )
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    def test_retries_are_limited(self, mock_sleep):
+        """Test that a connection that keeps failing gives up after the last backoff."""
+        argv = self._argv(100, 255, "ssh: connect to host 192.0.2.10 port 22: Connection timed out")
+        with self.assertLogs("vps_ibr.utils.ssh", level="WARNING"):
+            result = ssh._run_ssh_argv("192.0.2.10", argv, False, None, ssh.MAX_OUTPUT_BYTES)
+        
+        self.assertIsNone(result)
+        self.assertEqual(self._attempts(), len(ssh.RETRY_BACKOFF) + 1)
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    def test_permanent_failure_is_not_retried(self, mock_sleep):
+        """Test that authentication and host key errors fail at once."""
+        failures = (
+            "root@192.0.2.10: Permission denied (publickey).", "Host key verification failed."
+        )
+        for stderr in failures:
+            with self.subTest(stderr=stderr):
+                if os.path.exists(self.counter):
+                    os.unlink(self.counter)
+                with self.assertLogs("vps_ibr.utils.ssh", level="ERROR"):
+                    result = ssh._run_ssh_argv(
+                        "192.0.2.10", self._argv(1, 255, stderr), False, None, ssh.MAX_OUTPUT_BYTES
+                    )
+                self.assertIsNone(result)
+                self.assertEqual(self._attempts(), 1)
+        mock_sleep.assert_not_called()
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    def test_command_failure_is_not_retried(self, mock_sleep):
+        """Test that a remote command exiting non-zero is not run again."""
+        argv = self._argv(1, 1, "Connection refused")
+        with self.assertLogs("vps_ibr.utils.ssh", level="ERROR"):
+            result = ssh._run_ssh_argv("192.0.2.10", argv, False, None, ssh.MAX_OUTPUT_BYTES)
+        
+        self.assertIsNone(result)
+        self.assertEqual(self._attempts(), 1)
+        mock_sleep.assert_not_called()
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    @patch('vps_ibr.utils.ssh.asyncssh', None)
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_scp_transient_failure_is_retried(self, mock_run, mock_sleep):
+        """Test that scp_get_file retries scp when the connection failed."""
+        def scp(command, **kwargs):
+            if mock_run.call_count == 1:
+                return _completed(
+                    255, stderr=b"ssh: connect to host 192.0.2.10 port 22: Connection refused"
+                )
+            with open(command[-1], 'wb') as f:
+                f.write(b"content")
+            return _completed()
+        mock_run.side_effect = scp
+        local_path = os.path.join(self.dir.name, "hosts")
+        
+        with self.assertLogs("vps_ibr.utils.ssh", level="WARNING"):
+            self.assertTrue(
+                ssh.scp_get_file("192.0.2.10", "/tmp/id_test", "/etc/hosts", local_path)
+            )
+        
+        self.assertEqual(mock_run.call_count, 2)
+        mock_sleep.assert_called_once_with(ssh.RETRY_BACKOFF[0])
+
+    @patch('vps_ibr.utils.ssh.time.sleep')
+    @patch('vps_ibr.utils.ssh.asyncssh', None)
+    @patch('vps_ibr.utils.ssh.subprocess.run')
+    def test_scp_permanent_failure_is_not_retried(self, mock_run, mock_sleep):
+        """Test that scp_get_file does not retry an authentication failure."""
+        mock_run.return_value = _completed(
+            255, stderr=b"root@192.0.2.10: Permission denied (publickey)."
+        )
+        local_path = os.path.join(self.dir.name, "hosts")
+        
+        self.assertFalse(ssh.scp_get_file("192.0.2.10", "/tmp/id_test", "/etc/hosts", local_path))
+        
+        mock_run.assert_called_once()
+        mock_sleep.assert_not_called()
+        self.assertFalse(os.path.exists(local_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pooled Paramiko SSH connections.
+"""
+import io
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from vps_ibr.utils import ssh, ssh_pool
+
+def _fake_client(output=b"", errors=b"", returncode=0):
+    """Return a stand-in for a connected paramiko.SSHClient."""
+    client = MagicMock()
+    client.get_transport.return_value.is_active.return_value = True
+    
+    def exec_command(command):
+        stdin, stdout, stderr = MagicMock(), MagicMock(), MagicMock()
+        stdout.read.side_effect = io.BytesIO(output).read
+        stdout.channel.recv_exit_status.return_value = returncode
+        stderr.read.side_effect = io.BytesIO(errors).read
+        client.streams = (stdin, stdout, stderr)
+        return client.streams
+    client.exec_command.side_effect = exec_command
+    return client
+
+@patch.dict(os.environ, {"VPS_IBR_USE_PARAMIKO": "1"})
+@patch('paramiko.SSHClient')
+class TestSSHPool(unittest.TestCase):
+    """Tests for running commands and copying files over pooled connections."""
+
+    def tearDown(self):
+        ssh_pool.close_all()
+
+    def test_run_command(self, mock_client_class):
+        """Test that run_ssh_command goes through the pool and feeds input."""
+        client = _fake_client(output=b"hello\n")
+        mock_client_class.return_value = client
+        
+        result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "cat", input="hello")
+        
+        self.assertEqual(result, "hello")
+        client.connect.assert_called_once()
+        self.assertEqual(client.connect.call_args.kwargs['username'], "root")
+        stdin = client.streams[0]
+        stdin.write.assert_called_once_with(b"hello")
+        stdin.close.assert_called_once()
+
+    def test_command_has_no_read_timeout(self, mock_client_class):
+        """Test that the timeout applies to connecting, not to a silent command."""
+        client = _fake_client(output=b"done")
+        mock_client_class.return_value = client
+        
+        ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "mysqldump -A > dump.sql", timeout=5)
+        
+        self.assertEqual(client.connect.call_args.kwargs['timeout'], 5)
+        self.assertEqual(client.exec_command.call_args.kwargs, {})
+
+    def test_output_cap(self, mock_client_class):
+        """Test that output beyond max_output_bytes stops the command."""
+        client = _fake_client(output=b"x" * 100)
+        mock_client_class.return_value = client
+        
+        with self.assertLogs("vps_ibr.utils.ssh_pool", level="ERROR") as logs:
+            result = ssh.run_ssh_command(
+                "192.0.2.10", "/tmp/id_test", "cat big", max_output_bytes=10
+            )
+        
+        self.assertIsNone(result)
+        self.assertIn("output exceeded 10 bytes", logs.output[0])
+        client.streams[1].channel.close.assert_called_once()
+        client.streams[1].channel.recv_exit_status.assert_not_called()
+        
+        # Output within the limit is returned as usual
+        self.assertEqual(ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "cat big"), "x" * 100)
+
+    def test_binary_output(self, mock_client_class):
+        """Test that binary mode returns the raw output bytes."""
+        mock_client_class.return_value = _fake_client(output=b"\x00data\n")
+        
+        result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "cat file", binary=True)
+        
+        self.assertEqual(result, b"\x00data\n")
+
+    def test_connection_is_reused(self, mock_client_class):
+        """Test that calls to the same server share one connection."""
+        mock_client_class.return_value = _fake_client(output=b"ok")
+        
+        ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "true")
+        ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "true")
+        
+        mock_client_class.assert_called_once()
+
+    def test_dead_connection_is_replaced(self, mock_client_class):
+        """Test that a dropped transport is closed and reconnected."""
+        dead, fresh = _fake_client(output=b"old"), _fake_client(output=b"new")
+        mock_client_class.side_effect = [dead, fresh]
+        
+        ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "true")
+        dead.get_transport.return_value.is_active.return_value = False
+        result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "true")
+        
+        self.assertEqual(result, "new")
+        dead.close.assert_called_once()
+
+    def test_command_failure(self, mock_client_class):
+        """Test that a non-zero exit status yields None and logs stderr."""
+        mock_client_class.return_value = _fake_client(errors=b"no such file", returncode=1)
+        
+        with self.assertLogs("vps_ibr.utils.ssh_pool", level="ERROR") as logs:
+            result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "cat /nope")
+        
+        self.assertIsNone(result)
+        self.assertIn("no such file", logs.output[0])
+
+    def test_socket_timeout(self, mock_client_class):
+        """Test that socket timeouts are reported as connect or command timeouts."""
+        client = _fake_client()
+        client.connect.side_effect = socket.timeout("timed out")
+        mock_client_class.return_value = client
+        
+        with self.assertLogs("vps_ibr.utils.ssh_pool", level="ERROR") as logs:
+            result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "true")
+        
+        self.assertIsNone(result)
+        self.assertIn("Timeout while connecting to 192.0.2.10", logs.output[0])
+        
+        client.connect.side_effect = None
+        client.exec_command.side_effect = socket.timeout("timed out")
+        with self.assertLogs("vps_ibr.utils.ssh_pool", level="ERROR") as logs:
+            result = ssh.run_ssh_command("192.0.2.10", "/tmp/id_test", "sleep 100")
+        
+        self.assertIsNone(result)
+        self.assertIn("Timeout while executing command on 192.0.2.10", logs.output[0])
+
+    def test_sftp_get_file(self, mock_client_class):
+        """Test copying a file over SFTP and rejecting empty files."""
+        client = _fake_client()
+        sftp = client.open_sftp.return_value
+        
+        def get(remote_path, local_path):
+            with open(local_path, 'wb') as f:
+                f.write(b"content")
+        sftp.get.side_effect = get
+        mock_client_class.return_value = client
+        
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_path = os.path.join(local_dir, "hosts")
+            
+            sftp.stat.return_value.st_size = 7
+            self.assertTrue(
+                ssh.scp_get_file("192.0.2.10", "/tmp/id_test", "/etc/hosts", local_path)
+            )
+            with open(local_path, 'rb') as f:
+                self.assertEqual(f.read(), b"content")
+            
+            sftp.stat.return_value.st_size = 0
+            self.assertFalse(
+                ssh.scp_get_file("192.0.2.10", "/tmp/id_test", "/etc/empty", local_path + ".empty")
+            )
+            
+            # Only the copied file is left; temporary files are removed
+            self.assertEqual(os.listdir(local_dir), ["hosts"])
+
+if __name__ == '__main__':
+    unittest.main()
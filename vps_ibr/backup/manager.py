@@ -4,11 +4,20 @@ Backup management module for VPS Inventory, Backup & Restore.
 """
 import os
 import json
+import shlex
 import datetime
+import subprocess
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
-from vps_ibr.utils.ssh import run_ssh_command, rsync_pull
+from vps_ibr.utils.ssh import (
+    run_ssh_command, run_ssh_commands_batch, rsync_pull, rsync_pull_many,
+    scp_get_files_tar, open_master_connection, close_mux
+)
 from vps_ibr.utils.file_utils import ensure_dir, save_json
+from vps_ibr.utils.console import safe_print
 from vps_ibr.inventory.parser import analyze_server_history
 
 # Service-specific backup handlers
@@ -41,6 +50,9 @@ SERVICE_BACKUP_HANDLERS = {
     }
 }
 
+# Concurrent service backups per server
+SERVICE_BACKUP_WORKERS = 4
+
 def create_backup(
     config: Dict[str, Any], 
     server_ip: Optional[str] = None,
@@ -69,74 +81,178 @@ def create_backup(
         
     os.makedirs(backup_dir, exist_ok=True)
     
+    # Read the global settings once; the workers only get the values
     global_config = config.get("global", {})
     default_ssh_key = global_config.get("default_ssh_key", "id_rsa")
     ssh_key_path_base = os.path.expanduser(global_config.get("ssh_key_path", "~/.ssh"))
+    timeout = global_config.get("timeout", 30)
+    bwlimit = global_config.get("rsync_bwlimit")
+    compress = global_config.get("rsync_compress")
+    max_workers = global_config.get("max_workers")
     
-    # Filter servers if specific IP provided
-    servers = [s for s in config.get("servers", []) if server_ip is None or s.get("ip") == server_ip]
+    # Select the requested server by IP, or back up all of them
+    servers = config.get("servers", [])
+    if server_ip is not None:
+        servers_by_ip = {s.get("ip"): s for s in servers}
+        servers = [servers_by_ip[server_ip]] if server_ip in servers_by_ip else []
     
     if server_ip and not servers:
-        print(f"Server with IP {server_ip} not found in configuration.")
+        safe_print(f"Server with IP {server_ip} not found in configuration.")
         return backup_dir
     
-    for server in servers:
-        ip = server.get("ip")
-        description = server.get("description", "No description")
-        ssh_key_name = server.get("ssh_key", default_ssh_key)
-        ssh_key_path = os.path.join(ssh_key_path_base, ssh_key_name)
-        
-        if not ip:
-            print("Server missing IP address, skipping.")
-            continue
-            
-        print(f"\nBacking up server: {ip} ({description})")
-        print(f"Using SSH key: {ssh_key_path}")
-        
-        # Create server directory with timestamp
-        today = datetime.datetime.now().strftime("%Y%m%d")
-        server_dir = os.path.join(backup_dir, f"{ip}-{today}")
-        os.makedirs(server_dir, exist_ok=True)
-        
-        # Save server metadata
-        with open(os.path.join(server_dir, "server_info.txt"), "w") as f:
-            f.write(f"IP: {ip}\n")
-            f.write(f"Description: {description}\n")
-            f.write(f"Backup Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    if not servers:
+        return backup_dir
+    
+    # Scan for inventory directories once per run, shared by all servers
+    _inventory_dirs.cache_clear()
+    _inventory_dirs(os.getcwd())
+    
+    # Resolve each distinct SSH key path once, shared read-only by the workers
+    ssh_key_paths = {
+        name: os.path.join(ssh_key_path_base, name)
+        for name in {s.get("ssh_key", default_ssh_key) for s in servers}
+    }
+    
+    # Servers are independent, so back them up concurrently
+    max_workers = max_workers or min(8, len(servers))
+    worker = functools.partial(
+        _backup_one_server,
+        backup_dir=backup_dir,
+        default_ssh_key=default_ssh_key,
+        ssh_key_paths=ssh_key_paths,
+        timeout=timeout,
+        bwlimit=bwlimit,
+        compress=compress
+    )
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        list(executor.map(worker, servers))
+    
+    return backup_dir
+
+def _backup_one_server(
+    server: Dict[str, Any],
+    backup_dir: str,
+    default_ssh_key: str,
+    ssh_key_paths: Dict[str, str],
+    timeout: int = 30,
+    bwlimit: Optional[str] = None,
+    compress: Optional[int] = None
+) -> None:
+    """
+    Back up a single server. Runs in a worker thread of create_backup.
+    
+    Args:
+        server: Server entry from the configuration
+        backup_dir: Backup directory shared by all servers
+        default_ssh_key: SSH key name used when the server does not set one
+        ssh_key_paths: Full SSH key paths keyed by key name
+        timeout: Timeout in seconds for the SSH connection
+        bwlimit: Optional rsync bandwidth limit
+        compress: Optional rsync compression level
+    """
+    ip = server.get("ip")
+    description = server.get("description", "No description")
+    ssh_key_path = ssh_key_paths[server.get("ssh_key", default_ssh_key)]
+    
+    if not ip:
+        safe_print("Server missing IP address, skipping.")
+        return
         
+    safe_print(f"\nBacking up server: {ip} ({description})")
+    safe_print(f"Using SSH key: {ssh_key_path}")
+    
+    # Create server directory with timestamp
+    now = datetime.datetime.now()
+    server_dir = os.path.join(backup_dir, f"{ip}-{now.strftime('%Y%m%d')}")
+    os.makedirs(server_dir, exist_ok=True)
+    
+    # Save server metadata
+    server_info = "".join([
+        f"IP: {ip}\n",
+        f"Description: {description}\n",
+        f"Backup Date: {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    ])
+    Path(server_dir, "server_info.txt").write_text(server_info)
+    
+    # Multiplex all SSH and rsync traffic for this server over one connection
+    open_master_connection(ip, ssh_key_path, timeout)
+    try:
         # First, look for inventory data
         inventory_data = find_inventory_for_server(ip)
         services_detected = []
         
         if inventory_data:
-            print(f"Found existing inventory for {ip}, using for targeted backup")
-            server_analysis = analyze_server_history(inventory_data)
-            
+            safe_print(f"Found existing inventory for {ip}, using for targeted backup")
+            server_analysis = _cached_analyze(inventory_data)
+        
             # Save analysis as backup metadata
             save_json(server_analysis, os.path.join(server_dir, "server_analysis.json"))
-            
+        
             # Extract services from analysis
             if "services" in server_analysis:
                 services_detected = server_analysis["services"]
         else:
-            print(f"No existing inventory found for {ip}, performing basic backup")
+            safe_print(f"No existing inventory found for {ip}, performing basic backup")
         
-        # Perform service-specific backups
-        for service in services_detected:
-            # Check if we have a handler for this service
-            if service in SERVICE_BACKUP_HANDLERS:
-                handler = SERVICE_BACKUP_HANDLERS[service]
-                backup_service(ip, ssh_key_path, service, handler, server_dir)
+        # Perform service-specific backups, only for services we have a handler for
+        handlers = [
+            (svc, SERVICE_BACKUP_HANDLERS[svc])
+            for svc in services_detected if svc in SERVICE_BACKUP_HANDLERS
+        ]
+        if handlers:
+            with ThreadPoolExecutor(max_workers=SERVICE_BACKUP_WORKERS) as executor:
+                list(executor.map(
+                    lambda item: backup_service(
+                        ip, ssh_key_path, item[0], item[1], server_dir, bwlimit, compress
+                    ),
+                    handlers
+                ))
         
         # Backup home directories for all users
-        backup_user_homes(ip, ssh_key_path, server_dir)
+        backup_user_homes(ip, ssh_key_path, server_dir, bwlimit, compress)
         
         # Backup important system configurations
-        backup_system_configs(ip, ssh_key_path, server_dir)
+        backup_system_configs(ip, ssh_key_path, server_dir, bwlimit, compress)
+    finally:
+        close_mux(ip)
+    
+    safe_print(f"Backup completed for {ip}")
+
+@functools.lru_cache(maxsize=1)
+def _inventory_dirs(cwd: str) -> Tuple[str, ...]:
+    """
+    List inventory directories in a directory, most recent first.
+    
+    Memoized so that concurrent server backups share one scan; create_backup
+    clears the cache at the start of every run.
+    
+    Args:
+        cwd: Directory to scan
         
-        print(f"Backup completed for {ip}")
+    Returns:
+        Paths of the inventory directories
+    """
+    with os.scandir(cwd) as entries:
+        names = [e.name for e in entries if e.is_dir() and e.name.startswith('ibr-')]
+    names.sort(reverse=True)  # Most recent first
+    return tuple(os.path.join(cwd, name) for name in names)
+
+@functools.lru_cache(maxsize=128)
+def _cached_analyze(inventory_path: str) -> Dict[str, Any]:
+    """
+    Analyze an inventory directory, reusing earlier results for the same path.
     
-    return backup_dir
+    Inventory directories are timestamped snapshots, so their analysis does
+    not change once computed. The returned dictionary is shared between
+    callers and must not be modified.
+    
+    Args:
+        inventory_path: Path to the server's inventory directory
+        
+    Returns:
+        Server analysis as returned by analyze_server_history
+    """
+    return analyze_server_history(inventory_path)
 
 def find_inventory_for_server(ip: str) -> Optional[str]:
     """
@@ -148,17 +264,16 @@ def find_inventory_for_server(ip: str) -> Optional[str]:
     Returns:
         Path to inventory directory or None if not found
     """
-    # Look in current directory for inventory folders
-    inventory_dirs = [d for d in os.listdir('.') if os.path.isdir(d) and d.startswith('ibr-')]
-    inventory_dirs.sort(reverse=True)  # Most recent first
+    prefix = f"{ip}-"
     
-    for inv_dir in inventory_dirs:
+    # Look in current directory for inventory folders
+    for inv_dir in _inventory_dirs(os.getcwd()):
         # Check if this inventory contains our server
-        server_dirs = [d for d in os.listdir(inv_dir) if d.startswith(f"{ip}-")]
+        with os.scandir(inv_dir) as entries:
+            server_dirs = [e.name for e in entries if e.name.startswith(prefix)]
         if server_dirs:
             # Return most recent
-            server_dirs.sort(reverse=True)
-            return os.path.join(inv_dir, server_dirs[0])
+            return os.path.join(inv_dir, max(server_dirs))
     
     return None
 
@@ -167,7 +282,9 @@ def backup_service(
     ssh_key_path: str, 
     service: str, 
     handler: Dict[str, Any], 
-    server_dir: str
+    server_dir: str,
+    bwlimit: Optional[str] = None,
+    compress: Optional[int] = None
 ) -> None:
     """
     Backup a specific service using its handler.
@@ -178,45 +295,57 @@ def backup_service(
         service: Service name
         handler: Service handler configuration
         server_dir: Directory to store backup
+        bwlimit: Optional per-transfer rsync bandwidth limit
+        compress: Optional rsync compression level
     """
-    print(f"  Backing up service: {service}")
+    safe_print(f"  Backing up service: {service}")
     
     # Create service directory
     service_dir = os.path.join(server_dir, "services", service)
     ensure_dir(service_dir)
     
-    # Backup paths
-    for path in handler.get("paths", []):
-        print(f"    Backing up path: {path}")
-        # Create local directory structure
-        local_path = os.path.join(service_dir, "files", path.lstrip('/'))
-        ensure_dir(os.path.dirname(local_path))
-        
-        # Use rsync to copy files
-        rsync_pull(ip, ssh_key_path, path, local_path)
+    # Backup paths, all in one rsync run
+    paths = handler.get("paths", [])
+    for path in paths:
+        safe_print(f"    Backing up path: {path}")
+    
+    files_dir = ensure_dir(os.path.join(service_dir, "files"))
+    rsync_pull_many(ip, ssh_key_path, paths, files_dir, bwlimit=bwlimit, compress=compress)
     
     # Run commands and save output
-    for cmd in handler.get("commands", []):
-        print(f"    Running command: {cmd}")
+    commands = handler.get("commands", [])
+    for cmd in commands:
+        safe_print(f"    Running command: {cmd}")
+    
+    outputs = run_ssh_commands_batch(ip, ssh_key_path, commands)
+    for cmd, output in zip(commands, outputs):
         cmd_name = cmd.split()[0]
-        output = run_ssh_command(ip, ssh_key_path, cmd)
         
         if output:
-            with open(os.path.join(service_dir, f"{cmd_name}_output.txt"), 'w') as f:
-                f.write(output)
-    
-    # Backup specific files
-    for file_path in handler.get("files", []):
-        print(f"    Backing up file: {file_path}")
-        # Use the filename for the local path
-        local_file = os.path.join(service_dir, "files", os.path.basename(file_path))
-        ensure_dir(os.path.dirname(local_file))
-        
-        # Use SCP to copy the file
-        run_ssh_command(ip, ssh_key_path, f"scp {file_path} root@localhost:/tmp/")
-        run_ssh_command(ip, ssh_key_path, f"rm {file_path}")  # Clean up temporary dump files
+            Path(service_dir, f"{cmd_name}_output.txt").write_text(output)
+    
+    # Backup specific files, saved under their file names, in one tar stream
+    file_paths = handler.get("files", [])
+    for file_path in file_paths:
+        safe_print(f"    Backing up file: {file_path}")
+    
+    if file_paths:
+        if scp_get_files_tar(ip, ssh_key_path, file_paths, files_dir):
+            # Clean up temporary dump files
+            remove_cmd = "rm -f " + " ".join(shlex.quote(path) for path in file_paths)
+            run_ssh_command(ip, ssh_key_path, remove_cmd)
+        else:
+            # Nothing was saved locally; keep the dumps so they can be fetched again
+            files = ", ".join(file_paths)
+            safe_print(f"    Could not copy files, leaving them on the server: {files}")
 
-def backup_user_homes(ip: str, ssh_key_path: str, server_dir: str) -> None:
+def backup_user_homes(
+    ip: str,
+    ssh_key_path: str,
+    server_dir: str,
+    bwlimit: Optional[str] = None,
+    compress: Optional[int] = None
+) -> None:
     """
     Backup home directories for all users.
     
@@ -224,8 +353,10 @@ def backup_user_homes(ip: str, ssh_key_path: str, server_dir: str) -> None:
         ip: Server IP
         ssh_key_path: Path to SSH key
         server_dir: Directory to store backup
+        bwlimit: Optional per-transfer rsync bandwidth limit
+        compress: Optional rsync compression level
     """
-    print("  Backing up user home directories")
+    safe_print("  Backing up user home directories")
     
     # Get list of users with home directories
     user_cmd = "awk -F: '$3 >= 1000 && $3 != 65534 {print $1 \":\" $6}' /etc/passwd"
@@ -238,32 +369,61 @@ def backup_user_homes(ip: str, ssh_key_path: str, server_dir: str) -> None:
     homes_dir = os.path.join(server_dir, "homes")
     ensure_dir(homes_dir)
     
+    # Exclude large and cache dirs
+    exclude = [
+        ".cache", 
+        "node_modules", 
+        ".venv", 
+        "venv", 
+        "env", 
+        "__pycache__",
+        "tmp",
+        "temp"
+    ]
+    
+    # Homes laid out as <parent>/<username> are pulled with one rsync per
+    # parent directory, selecting the users with include filters
+    by_parent: Dict[str, List[str]] = {}
+    individual: List[Tuple[str, str]] = []
+    
     for line in output.splitlines():
         parts = line.strip().split(":")
         if len(parts) >= 2:
             username = parts[0]
-            home_dir = parts[1]
+            home_dir = parts[1].rstrip('/')
             
-            print(f"    Backing up home directory for user: {username}")
+            safe_print(f"    Backing up home directory for user: {username}")
             
             # Create user directory
-            user_backup_dir = os.path.join(homes_dir, username)
-            ensure_dir(user_backup_dir)
+            ensure_dir(os.path.join(homes_dir, username))
             
-            # Use rsync to copy home directory, excluding large and cache dirs
-            exclude = [
-                ".cache", 
-                "node_modules", 
-                ".venv", 
-                "venv", 
-                "env", 
-                "__pycache__",
-                "tmp",
-                "temp"
-            ]
-            rsync_pull(ip, ssh_key_path, f"{home_dir}/", user_backup_dir, exclude)
+            parent, name = os.path.split(home_dir)
+            if parent and name == username and username not in exclude:
+                by_parent.setdefault(parent, []).append(username)
+            else:
+                individual.append((username, home_dir))
+    
+    for parent, usernames in by_parent.items():
+        include = [f"/{username}/***" for username in usernames]
+        rsync_pull(
+            ip, ssh_key_path, f"{parent.rstrip('/')}/", homes_dir, exclude,
+            include=include, bwlimit=bwlimit, compress=compress
+        )
+    
+    for username, home_dir in individual:
+        user_backup_dir = os.path.join(homes_dir, username)
+        rsync_pull(
+            ip, ssh_key_path, f"{home_dir}/", user_backup_dir, exclude,
+            bwlimit=bwlimit, compress=compress
+        )
 
-def backup_system_configs(ip: str, ssh_key_path: str, server_dir: str) -> None:
+def backup_system_configs(
+    ip: str,
+    ssh_key_path: str,
+    server_dir: str,
+    bwlimit: Optional[str] = None,
+    compress: Optional[int] = None
+) -> None:
     """
     Backup important system configuration files.
     
@@ -271,8 +431,10 @@ def backup_system_configs(ip: str, ssh_key_path: str, server_dir: str) -> None:
         ip: Server IP
         ssh_key_path: Path to SSH key
         server_dir: Directory to store backup
+        bwlimit: Optional per-transfer rsync bandwidth limit
+        compress: Optional rsync compression level
     """
-    print("  Backing up system configuration files")
+    safe_print("  Backing up system configuration files")
     
     # Create system directory
     system_dir = os.path.join(server_dir, "system")
@@ -286,14 +448,13 @@ def backup_system_configs(ip: str, ssh_key_path: str, server_dir: str) -> None:
     ]
     
     for path in system_paths:
-        print(f"    Backing up system path: {path}")
-        # Create local directory structure
-        local_path = os.path.join(system_dir, path.lstrip('/'))
-        ensure_dir(os.path.dirname(local_path))
-        
-        # Use rsync to copy files
-        exclude = ["*.log", "*.gz", "*.old", "*.bak"]
-        rsync_pull(ip, ssh_key_path, path, local_path, exclude)
+        safe_print(f"    Backing up system path: {path}")
+    
+    # Use a single rsync run for all paths
+    exclude = ["*.log", "*.gz", "*.old", "*.bak"]
+    rsync_pull_many(
+        ip, ssh_key_path, system_paths, system_dir, exclude, bwlimit=bwlimit, compress=compress
+    )
     
     # Capture system information
     system_commands = [
@@ -310,13 +471,13 @@ def backup_system_configs(ip: str, ssh_key_path: str, server_dir: str) -> None:
     ]
     
     # Run commands and save output
-    for cmd in system_commands:
+    # The commands are read-only and independent, so run them concurrently
+    outputs = run_ssh_commands_batch(ip, ssh_key_path, system_commands, parallel=True)
+    for cmd, output in zip(system_commands, outputs):
         cmd_name = cmd.split()[0].replace('-', '_')
-        output = run_ssh_command(ip, ssh_key_path, cmd)
         
         if output:
-            with open(os.path.join(system_dir, f"{cmd_name}_output.txt"), 'w') as f:
-                f.write(output)
+            Path(system_dir, f"{cmd_name}_output.txt").write_text(output)
     
     # Create a backup summary
     create_backup_summary(server_dir)
@@ -353,37 +514,71 @@ def create_backup_summary(server_dir: str) -> None:
     # Save summary
     save_json(summary, os.path.join(server_dir, "backup_summary.json"))
     
-    # Create human-readable summary
-    with open(os.path.join(server_dir, "backup_summary.txt"), 'w') as f:
-        f.write(f"Backup Date: {summary['backup_date']}\n\n")
-        
-        f.write(f"Backup Size: {format_size(summary['backup_size'])}\n\n")
-        
-        f.write("Backed Up Services:\n")
-        for service in summary['services']:
-            f.write(f"  - {service}\n")
-        f.write("\n")
-        
-        f.write("Backed Up Users:\n")
-        for user in summary['users']:
-            f.write(f"  - {user}\n")
+    # Create human-readable summary, built in memory and written at once
+    parts = [
+        f"Backup Date: {summary['backup_date']}\n\n",
+        f"Backup Size: {format_size(summary['backup_size'])}\n\n",
+        "Backed Up Services:\n"
+    ]
+    parts.extend(f"  - {service}\n" for service in summary['services'])
+    parts.append("\n")
+    
+    parts.append("Backed Up Users:\n")
+    parts.extend(f"  - {user}\n" for user in summary['users'])
+    
+    Path(server_dir, "backup_summary.txt").write_text("".join(parts))
 
 def get_dir_size(path: str) -> int:
     """
     Calculate the total size of a directory in bytes.
     
+    On POSIX systems this uses `du -sb`, which walks the tree in C; elsewhere,
+    or if du is unavailable or lacks -b (e.g. BSD du), the tree is walked in
+    Python.
+    
+    Args:
+        path: Directory path
+        
+    Returns:
+        Size in bytes
+    """
+    if os.name == "posix":
+        try:
+            output = subprocess.check_output(["du", "-sb", path], stderr=subprocess.DEVNULL)
+            return int(output.split()[0])
+        except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+            pass
+    
+    return _get_dir_size_scandir(path)
+
+def _get_dir_size_scandir(path: str) -> int:
+    """
+    Calculate the total size of the regular files under a directory in bytes.
+    
     Args:
         path: Directory path
         
     Returns:
         Size in bytes
     """
+    # Iterative scandir walk: DirEntry caches the file type from readdir, so
+    # each file costs a single stat call
     total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            file_path = os.path.join(dirpath, f)
-            if os.path.exists(file_path) and os.path.isfile(file_path):
-                total_size += os.path.getsize(file_path)
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            total_size += entry.stat(follow_symlinks=False).st_size
+                        except FileNotFoundError:
+                            pass
+        except OSError:
+            # Unreadable or vanished directory, as os.walk would skip it
+            continue
     return total_size
 
 def format_size(size_bytes: int) -> str:
@@ -396,18 +591,15 @@ def format_size(size_bytes: int) -> str:
     Returns:
         Formatted size string
     """
-    # Define units and thresholds
-    units = ['B', 'KB', 'MB', 'GB', 'TB']
+    # Define units; each is 2**10 times the previous one
+    units = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
     
     # Handle zero size
     if size_bytes == 0:
         return "0 B"
     
-    # Calculate the appropriate unit
-    i = 0
-    while size_bytes >= 1024 and i < len(units) - 1:
-        size_bytes /= 1024.0
-        i += 1
+    # The unit index is the number of whole 10-bit groups above the first bit
+    i = min(len(units) - 1, (int(size_bytes).bit_length() - 1) // 10)
     
     # Format with two decimal places
-    return f"{size_bytes:.2f} {units[i]}"
\ No newline at end of file
+    return f"{size_bytes / (1 << (10 * i)):.2f} {units[i]}"
\ No newline at end of file
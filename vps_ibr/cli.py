@@ -4,6 +4,7 @@ Command Line Interface for the VPS Inventory, Backup & Restore tool.
 """
 import os
 import sys
+import logging
 import click
 
 from vps_ibr.config import load_config
@@ -111,6 +112,10 @@ def restore(backup_dir, target_ip, ssh_key):
 
 def main():
     """Main entry point for the CLI."""
+    # Messages of the vps_ibr modules go to stdout as plain lines; other
+    # libraries only report warnings
+    logging.basicConfig(format="%(message)s", stream=sys.stdout)
+    logging.getLogger("vps_ibr").setLevel(logging.INFO)
     cli()
 
 if __name__ == "__main__":
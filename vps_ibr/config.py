@@ -3,32 +3,150 @@
 Configuration handling for VPS Inventory, Backup & Restore.
 """
 import os
+import json
+import tempfile
 import yaml
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from vps_ibr import __version__
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
+# orjson is an optional, much faster JSON encoder and decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bump when the layout of the configuration cache changes
+CACHE_SCHEMA_VERSION = 1
 
 def load_config(config_path: str) -> Optional[Dict[str, Any]]:
     """
-    Load server configuration from YAML file.
+    Load server configuration from a YAML or JSON file.
+    
+    Files with a .json extension are parsed as JSON, anything else as YAML.
+    The parsed file is cached as JSON next to it and reused for as long as
+    the file and the installed package version are unchanged; the
+    configuration is validated on every load.
     
     Args:
-        config_path: Path to the YAML configuration file
+        config_path: Path to the configuration file
         
     Returns:
         Dictionary containing configuration or None if loading fails
     """
     try:
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
+        stat = os.stat(config_path)
+        cache_key = [__version__, CACHE_SCHEMA_VERSION, stat.st_mtime_ns, stat.st_size]
+        
+        config = _load_cached_config(config_path, cache_key)
+        if config is None:
+            with open(config_path, 'r') as file:
+                if config_path.lower().endswith('.json'):
+                    config = json.load(file)
+                else:
+                    config = yaml.load(file, Loader=_SafeLoader)
             
+            # Serialized before validation fills in defaults, so later
+            # versions apply their own
+            cache_content = _encode_cache(cache_key, config)
+        else:
+            cache_content = None
+        
         # Validate configuration
         if not validate_config(config):
             return None
-            
+        
+        if cache_content is not None:
+            _save_cached_config(config_path, cache_content)
         return config
     except Exception as e:
         print(f"Error loading configuration file: {e}")
         return None
 
+def _cache_path(config_path: str) -> str:
+    """Return the path of the parsed-configuration cache for config_path."""
+    return f"{config_path}.cache.json"
+
+def _loads_json(content: bytes) -> Any:
+    """Parse UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _load_cached_config(config_path: str, cache_key: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Load a cached configuration if it matches the current file.
+    
+    Args:
+        config_path: Path to the configuration file
+        cache_key: Package version, cache schema version, and modification
+            time (ns) and size of the configuration file
+        
+    Returns:
+        Cached configuration, not yet validated, or None on a cache miss
+    """
+    try:
+        with open(_cache_path(config_path), 'rb') as file:
+            cache = _loads_json(file.read())
+        if cache["key"] != cache_key or not isinstance(cache["config"], dict):
+            return None
+        return cache["config"]
+    except Exception:
+        return None
+
+def _encode_cache(cache_key: List[Any], config: Any) -> Optional[bytes]:
+    """
+    Serialize a parsed configuration for the cache.
+    
+    Args:
+        cache_key: Key the cache is stored under (see _load_cached_config)
+        config: Configuration as parsed from its file
+        
+    Returns:
+        Cache file content, or None if the configuration does not survive a
+        JSON round trip unchanged (e.g. YAML dates or non-string keys)
+    """
+    try:
+        if orjson is not None:
+            content = orjson.dumps({"key": cache_key, "config": config})
+        else:
+            content = json.dumps({"key": cache_key, "config": config}).encode('utf-8')
+        if _loads_json(content)["config"] != config:
+            return None
+        return content
+    except Exception:
+        return None
+
+def _save_cached_config(config_path: str, content: bytes) -> None:
+    """
+    Write the configuration cache next to its file.
+    
+    The cache is written to a temporary file and moved into place, so a reader
+    never sees a partial file. Failures are ignored; caching is best effort.
+    
+    Args:
+        config_path: Path to the configuration file
+        content: Cache file content from _encode_cache
+    """
+    cache_path = _cache_path(config_path)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except Exception:
+        pass
+
 def validate_config(config: Dict[str, Any]) -> bool:
     """
     Validate the loaded configuration.
@@ -3,18 +3,42 @@
 Inventory collection module for VPS Inventory, Backup & Restore.
 """
 import os
+import re
+import shlex
 import shutil
+import tarfile
 import tempfile
 import datetime
-from typing import Dict, Any, List, Optional
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
-from vps_ibr.utils.ssh import run_ssh_command, scp_get_file
+from vps_ibr.utils.ssh import SSHSession
+from vps_ibr.utils.console import safe_print
 from vps_ibr.inventory.parser import parse_bash_history
 
+# Remote probes, shared by the single-command helpers and the combined script
+USERS_CMD = "awk -F: '$3 >= 1000 && $3 != 65534 {print $1 \":\" $6}' /etc/passwd"
+SUDO_GROUP_CMD = "getent group sudo | cut -d: -f4"
+SUDOERS_CMD = (
+    "grep -v '^#' /etc/sudoers | grep -v '^Defaults' | grep 'ALL=(ALL:ALL)' "
+    "| cut -d' ' -f1"
+)
+
+# Sentinel preceding each part of the combined inventory output
+_SECTION_RE = re.compile(rb"\0SECTION:([^\0\n]*)\0")
+
+# Parallel scp workers per server when bash histories are copied one by one
+HISTORY_COPY_WORKERS = 8
+
 def create_inventory(config: Dict[str, Any], output_dir: Optional[str] = None) -> str:
     """
     Create inventory for all servers in config.
     
+    Servers are processed concurrently, up to the global max_workers setting
+    (default: one worker per server, at most 8).
+    
     Args:
         config: Loaded configuration dictionary
         output_dir: Optional output directory (auto-generated if None)
@@ -37,70 +61,222 @@ def create_inventory(config: Dict[str, Any], output_dir: Optional[str] = None) -
     global_config = config.get("global", {})
     default_ssh_key = global_config.get("default_ssh_key", "id_rsa")
     ssh_key_path_base = os.path.expanduser(global_config.get("ssh_key_path", "~/.ssh"))
+    timeout = global_config.get("timeout", 30)
     
-    for server in config.get("servers", []):
-        ip = server.get("ip")
-        description = server.get("description", "No description")
-        ssh_key_name = server.get("ssh_key", default_ssh_key)
-        ssh_key_path = os.path.join(ssh_key_path_base, ssh_key_name)
-        
-        if not ip:
-            print("Server missing IP address, skipping.")
-            continue
-            
-        print(f"\nProcessing server: {ip} ({description})")
-        print(f"Using SSH key: {ssh_key_path}")
+    servers = config.get("servers", [])
+    if not servers:
+        return result_dir
+    
+    # Inventory is I/O-bound on SSH round-trips, so servers run concurrently
+    max_workers = global_config.get("max_workers") or min(8, len(servers))
+    worker = functools.partial(
+        _inventory_one_server,
+        result_dir=result_dir,
+        default_ssh_key=default_ssh_key,
+        ssh_key_path_base=ssh_key_path_base,
+        timeout=timeout
+    )
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        list(executor.map(worker, servers))
         
-        # Create server directory with timestamp
-        today = datetime.datetime.now().strftime("%Y%m%d")
-        server_dir = os.path.join(result_dir, f"{ip}-{today}")
-        os.makedirs(server_dir, exist_ok=True)
+    return result_dir
+
+def _inventory_one_server(
+    server: Dict[str, Any],
+    result_dir: str,
+    default_ssh_key: str,
+    ssh_key_path_base: str,
+    timeout: int = 30
+) -> None:
+    """
+    Collect the inventory of a single server. Runs in a worker thread of create_inventory.
+    
+    Args:
+        server: Server entry from the configuration
+        result_dir: Inventory directory shared by all servers
+        default_ssh_key: SSH key name used when the server does not set one
+        ssh_key_path_base: Directory containing the SSH keys
+        timeout: Timeout in seconds for the SSH connection
+    """
+    ip = server.get("ip")
+    description = server.get("description", "No description")
+    ssh_key_name = server.get("ssh_key", default_ssh_key)
+    ssh_key_path = os.path.join(ssh_key_path_base, ssh_key_name)
+    
+    if not ip:
+        safe_print("Server missing IP address, skipping.")
+        return
         
-        # Save server metadata
-        with open(os.path.join(server_dir, "server_info.txt"), "w") as f:
-            f.write(f"IP: {ip}\n")
-            f.write(f"Description: {description}\n")
-            f.write(f"Inventory Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    safe_print(f"\nProcessing server: {ip} ({description})")
+    safe_print(f"Using SSH key: {ssh_key_path}")
+    
+    # Create server directory with timestamp; the clock is read once so the
+    # directory name and the metadata agree
+    now = datetime.datetime.now()
+    today = now.strftime("%Y%m%d")
+    stamp = now.strftime('%Y-%m-%d %H:%M:%S')
+    server_dir = os.path.join(result_dir, f"{ip}-{today}")
+    os.makedirs(server_dir, exist_ok=True)
+    
+    # Save server metadata
+    server_info = "".join([
+        f"IP: {ip}\n",
+        f"Description: {description}\n",
+        f"Inventory Date: {stamp}\n"
+    ])
+    Path(server_dir, "server_info.txt").write_text(server_info)
+    
+    # Create users directory
+    os.makedirs(os.path.join(server_dir, "users"), exist_ok=True)
+    
+    # All commands and copies for this server share one SSH connection
+    with SSHSession(ip, ssh_key_path, timeout) as session:
+        # Get users and sudo users in a single round-trip
+        safe_print(f"  [{ip}] Getting list of users...")
+        output = session.run(collect_inventory_script(), binary=True)
         
-        # Create users directory
-        os.makedirs(os.path.join(server_dir, "users"), exist_ok=True)
+        if output is not None:
+            users, sudo_users = parse_combined_output(output)
+        else:
+            # Fall back to one command per probe
+            users = get_users(session)
+            sudo_users = get_sudo_users(session)
         
-        # Get list of users
-        print("  Getting list of users...")
-        users = get_users(ip, ssh_key_path)
+        # Save list of sudo users
+        Path(server_dir, "sudo_users.txt").write_text("".join(f"{user}\n" for user in sudo_users))
         
-        # Get sudo users for reference
-        sudo_users = get_sudo_users(ip, ssh_key_path)
+        # Copy all bash histories in one stream, or one by one if that fails
+        safe_print(f"  [{ip}] Copying bash history files...")
+        if not stream_histories(session, users, server_dir):
+            with ThreadPoolExecutor(max_workers=HISTORY_COPY_WORKERS) as executor:
+                list(executor.map(
+                    lambda user: copy_bash_history(session, user, server_dir), users
+                ))
         
-        # Save list of sudo users
-        with open(os.path.join(server_dir, "sudo_users.txt"), "w") as f:
-            for user in sudo_users:
-                f.write(f"{user}\n")
+    # Optional: Parse bash histories to detect services (placeholder for future)
+    safe_print(f"  [{ip}] Inventory collected successfully.")
+
+def collect_inventory_script() -> str:
+    """
+    Build the remote script that collects a server's user facts in one go.
+    
+    The script prints the users, the sudo group members and the sudoers
+    entries, each part preceded by a \\0SECTION:<name>\\0 sentinel so that
+    parse_combined_output can split the output again.
+    
+    Returns:
+        Shell script to run on the server
+    """
+    return (
+        f"printf '\\0SECTION:users\\0'; {USERS_CMD}; "
+        f"printf '\\0SECTION:sudo_group\\0'; {SUDO_GROUP_CMD}; "
+        f"printf '\\0SECTION:sudoers\\0'; {SUDOERS_CMD}; "
+        "true"
+    )
+
+def parse_combined_output(output: bytes) -> Tuple[List[Dict[str, str]], List[str]]:
+    """
+    Split the output of collect_inventory_script.
+    
+    Args:
+        output: Raw output of the script
         
-        # Copy bash history for each user
-        print("  Copying bash history files...")
-        for user in users:
-            copy_bash_history(ip, ssh_key_path, user, server_dir)
-            
-        # Optional: Parse bash histories to detect services (placeholder for future)
-        print("  Inventory collected successfully.")
+    Returns:
+        Tuple of the users (as returned by get_users) and the sudo users (as
+        returned by get_sudo_users)
+    """
+    # With one group, split yields [prefix, name, body, name, body, ...]
+    parts = _SECTION_RE.split(output)
+    sections = {
+        name.decode("utf-8", "replace"): body.decode("utf-8", "replace")
+        for name, body in zip(parts[1::2], parts[2::2])
+    }
+    
+    users = _parse_users(sections.get("users", ""))
+    sudo_users = _parse_sudo_users(sections.get("sudo_group", ""), sections.get("sudoers", ""))
+    
+    return users, sudo_users
+
+def stream_histories(session: SSHSession, users: List[Dict[str, str]], server_dir: str) -> bool:
+    """
+    Copy the bash histories of all users in a single compressed tar stream.
+    
+    Args:
+        session: SSH session to the server
+        users: Users of the server
+        server_dir: Directory to store the histories
         
-    return result_dir
+    Returns:
+        True if the stream was read, False if it failed and copy_bash_history
+        should be used instead
+    """
+    # Archive member names are the history paths relative to /, mapped back
+    # to the users sharing them
+    members: Dict[str, List[str]] = {}
+    for user in users:
+        path = f"{user['home'].rstrip('/')}/.bash_history".lstrip("/")
+        members.setdefault(path, []).append(user["username"])
+        os.makedirs(os.path.join(server_dir, "users", user["username"]), exist_ok=True)
+    
+    # -h follows symlinked histories, as scp does; missing files are left out
+    paths = " ".join(shlex.quote(path) for path in members)
+    command = f"tar czhf - -C / {paths} 2>/dev/null"
+    
+    copied = set()
+    try:
+        process = session.open_stream(command)
+    except OSError as e:
+        safe_print(f"  [{session.ip}] Could not stream bash histories: {e}")
+        return False
+    
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|gz") as tar:
+            for member in tar:
+                usernames = members.get(member.name)
+                if not usernames or not member.isfile() or member.size == 0:
+                    continue
+                history = tar.extractfile(member).read()
+                for username in usernames:
+                    Path(server_dir, "users", username, "bash_history").write_bytes(history)
+                    copied.add(username)
+    except (tarfile.TarError, OSError, EOFError) as e:
+        safe_print(f"  [{session.ip}] Could not stream bash histories: {e}")
+        return False
+    finally:
+        process.stdout.close()
+        process.wait()
+    
+    for user in users:
+        username = user["username"]
+        if username in copied:
+            safe_print(f"  - [{session.ip}] Copied bash history for user {username}")
+        else:
+            safe_print(f"  - [{session.ip}] Could not copy bash history for user {username}")
+    
+    return True
 
-def get_users(ip: str, ssh_key_path: str) -> List[Dict[str, str]]:
+def get_users(session: SSHSession) -> List[Dict[str, str]]:
     """
     Get list of users on the server with home directories.
     
     Args:
-        ip: Server IP address
-        ssh_key_path: Path to SSH key
+        session: SSH session to the server
         
     Returns:
         List of dictionaries with username and home directory
     """
-    command = "awk -F: '$3 >= 1000 && $3 != 65534 {print $1 \":\" $6}' /etc/passwd"
-    output = run_ssh_command(ip, ssh_key_path, command)
+    return _parse_users(session.run(USERS_CMD) or "")
+
+def _parse_users(output: str) -> List[Dict[str, str]]:
+    """
+    Parse the username:home lines printed by USERS_CMD.
     
+    Args:
+        output: Command output
+        
+    Returns:
+        List of dictionaries with username and home directory, root last
+    """
     users = []
     if output:
         for line in output.splitlines():
@@ -113,25 +289,35 @@ def get_users(ip: str, ssh_key_path: str) -> List[Dict[str, str]]:
     
     return users
 
-def get_sudo_users(ip: str, ssh_key_path: str) -> List[str]:
+def get_sudo_users(session: SSHSession) -> List[str]:
     """
     Get list of users with sudo privileges.
     
     Args:
-        ip: Server IP address
-        ssh_key_path: Path to SSH key
+        session: SSH session to the server
         
     Returns:
         List of usernames with sudo privileges
     """
     # Check sudo group members
-    sudo_group_cmd = "getent group sudo | cut -d: -f4"
-    sudo_group = run_ssh_command(ip, ssh_key_path, sudo_group_cmd) or ""
+    sudo_group = session.run(SUDO_GROUP_CMD) or ""
     
     # Check sudoers file
-    sudoers_cmd = "grep -v '^#' /etc/sudoers | grep -v '^Defaults' | grep 'ALL=(ALL:ALL)' | cut -d' ' -f1"
-    sudoers = run_ssh_command(ip, ssh_key_path, sudoers_cmd) or ""
+    sudoers = session.run(SUDOERS_CMD) or ""
     
+    return _parse_sudo_users(sudo_group, sudoers)
+
+def _parse_sudo_users(sudo_group: str, sudoers: str) -> List[str]:
+    """
+    Combine the outputs of SUDO_GROUP_CMD and SUDOERS_CMD.
+    
+    Args:
+        sudo_group: Comma-separated members of the sudo group
+        sudoers: User names from /etc/sudoers, one per line
+        
+    Returns:
+        List of usernames with sudo privileges
+    """
     # Combine results
     sudo_users = set()
     for user in sudo_group.split(","):
@@ -144,13 +330,12 @@ def get_sudo_users(ip: str, ssh_key_path: str) -> List[str]:
     
     return list(sudo_users)
 
-def copy_bash_history(ip: str, ssh_key_path: str, user: Dict[str, str], server_dir: str) -> None:
+def copy_bash_history(session: SSHSession, user: Dict[str, str], server_dir: str) -> None:
     """
     Copy bash history for a specific user.
     
     Args:
-        ip: Server IP address
-        ssh_key_path: Path to SSH key
+        session: SSH session to the server
         user: User dictionary with username and home directory
         server_dir: Directory to store the history
     """
@@ -165,9 +350,9 @@ def copy_bash_history(ip: str, ssh_key_path: str, user: Dict[str, str], server_d
     history_path = f"{home_dir}/.bash_history"
     
     # Attempt to copy the history file
-    success = scp_get_file(ip, ssh_key_path, history_path, os.path.join(user_dir, "bash_history"))
+    success = session.get_file(history_path, os.path.join(user_dir, "bash_history"))
     
     if success:
-        print(f"  - Copied bash history for user {username}")
+        safe_print(f"  - [{session.ip}] Copied bash history for user {username}")
     else:
-        print(f"  - Could not copy bash history for user {username}")
\ No newline at end of file
+        safe_print(f"  - [{session.ip}] Could not copy bash history for user {username}")
\ No newline at end of file
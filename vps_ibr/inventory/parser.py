@@ -2,48 +2,76 @@
 """
 Parser module for bash history and installed services detection.
 """
-import re
+import mmap
+import bisect
 import os
+
+# RE2 matches in linear time with no backtracking; the stdlib engine is used
+# when google-re2 is not installed. None of the patterns below use
+# backreferences or lookarounds, so they run unchanged on either engine.
+try:
+    import re2 as re
+except ImportError:
+    import re
 from typing import Dict, List, Set, Any, Tuple
 
-# Regular expressions for common package managers and commands
+# Regular expressions for common package managers and commands, one per
+# package manager. The named group captures the package and is named after
+# the package manager. [ \t] instead of \s keeps matches within one line,
+# as the whole history file is scanned at once. The patterns are bytes so
+# they can run directly over the memory-mapped file.
 PACKAGE_PATTERNS = {
-    "apt": [
-        r"apt(-get)?\s+install\s+([a-zA-Z0-9\-\.]+)",
-        r"apt(-get)?\s+install\s+(-y\s+)?([a-zA-Z0-9\-\.]+)"
-    ],
-    "yum": [
-        r"yum\s+install\s+([a-zA-Z0-9\-\.]+)",
-        r"yum\s+install\s+(-y\s+)?([a-zA-Z0-9\-\.]+)"
-    ],
-    "dnf": [
-        r"dnf\s+install\s+([a-zA-Z0-9\-\.]+)",
-        r"dnf\s+install\s+(-y\s+)?([a-zA-Z0-9\-\.]+)"
-    ],
-    "pip": [
-        r"pip\s+install\s+([a-zA-Z0-9\-\.]+)",
-        r"pip3\s+install\s+([a-zA-Z0-9\-\.]+)"
-    ],
-    "npm": [
-        r"npm\s+install\s+(-g\s+)?([a-zA-Z0-9\-\.@/]+)"
-    ],
-    "docker": [
-        r"docker\s+run\s+.*\s+([a-zA-Z0-9\-\./]+:[a-zA-Z0-9\-\.]+)",
-        r"docker\s+pull\s+([a-zA-Z0-9\-\./]+:[a-zA-Z0-9\-\.]+)"
-    ]
+    "apt": rb"apt(?:-get)?[ \t]+install[ \t]+(?:-y[ \t]+)?(?P<apt>[a-zA-Z0-9\-\.]+)",
+    "yum": rb"yum[ \t]+install[ \t]+(?:-y[ \t]+)?(?P<yum>[a-zA-Z0-9\-\.]+)",
+    "dnf": rb"dnf[ \t]+install[ \t]+(?:-y[ \t]+)?(?P<dnf>[a-zA-Z0-9\-\.]+)",
+    "pip": rb"pip3?[ \t]+install[ \t]+(?P<pip>[a-zA-Z0-9\-\.]+)",
+    "npm": rb"npm[ \t]+install[ \t]+(?:-g[ \t]+)?(?P<npm>[a-zA-Z0-9\-\.@/]+)",
+    # The run arguments stop at the end of the command, so commands chained
+    # after it on the same line are still matched
+    "docker": (
+        rb"docker[ \t]+(?:run[ \t]+[^\n;&|]*[ \t]+|pull[ \t]+)"
+        rb"(?P<docker>[a-zA-Z0-9\-\./]+:[a-zA-Z0-9\-\.]+)"
+    )
 }
 
-# Patterns for service management
-SERVICE_PATTERNS = [
-    r"systemctl\s+(start|enable|restart|status)\s+([a-zA-Z0-9\-\.]+)",
-    r"service\s+([a-zA-Z0-9\-\.]+)\s+(start|restart|stop|status)"
-]
+# Patterns for service management; group names must be unique, so the
+# SysV form uses its own name
+SERVICE_PATTERNS = {
+    "service": (
+        rb"systemctl[ \t]+(?:start|enable|restart|status)[ \t]+"
+        rb"(?P<service>[a-zA-Z0-9\-\.]+)"
+    ),
+    "sysv_service": (
+        rb"service[ \t]+(?P<sysv_service>[a-zA-Z0-9\-\.]+)"
+        rb"[ \t]+(?:start|restart|stop|status)"
+    )
+}
 
 # Patterns for user management
-USER_PATTERNS = [
-    r"useradd\s+(-m\s+)?([a-zA-Z0-9\-\_]+)",
-    r"adduser\s+([a-zA-Z0-9\-\_]+)"
-]
+USER_PATTERNS = {
+    "user": rb"(?:useradd[ \t]+(?:-m[ \t]+)?|adduser[ \t]+)(?P<user>[a-zA-Z0-9\-\_]+)"
+}
+
+# All patterns as a single regex, so the history is scanned once; the name
+# of the group that matched tells which pattern it was
+HISTORY_RE = re.compile(b"|".join(
+    [*PACKAGE_PATTERNS.values(), *SERVICE_PATTERNS.values(), *USER_PATTERNS.values()]
+))
+
+# Result key of each group name: the package manager for package patterns,
+# "services" or "users" for the others
+_GROUP_KEYS = {
+    **{pkg_manager: pkg_manager for pkg_manager in PACKAGE_PATTERNS},
+    **dict.fromkeys(SERVICE_PATTERNS, "services"),
+    **dict.fromkeys(USER_PATTERNS, "users")
+}
+
+# Result key by group number; RE2 reports the names of bytes patterns as
+# bytes, the stdlib engine as str
+HISTORY_GROUPS = {
+    index: _GROUP_KEYS[name.decode() if isinstance(name, bytes) else name]
+    for name, index in HISTORY_RE.groupindex.items()
+}
 
 def parse_bash_history(history_file: str) -> Dict[str, Any]:
     """
@@ -53,65 +81,64 @@ def parse_bash_history(history_file: str) -> Dict[str, Any]:
         history_file: Path to bash history file
         
     Returns:
-        Dictionary with detected packages, services, and users
+        Dictionary with detected packages, services, and users, each listed
+        once in the order first seen in the history
     """
     if not os.path.exists(history_file) or os.path.getsize(history_file) == 0:
-        return {
-            "packages": {},
-            "services": [],
-            "users": []
-        }
+        return _empty_result()
     
-    with open(history_file, 'r', encoding='utf-8', errors='ignore') as f:
-        history_content = f.readlines()
+    # Collect matches per result key; dicts dedupe while keeping history order
+    found = _new_found()
     
-    # Initialize result dictionary
-    result = {
+    # Scan the mapped file in place; only the matched items are decoded
+    with open(history_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as history_content:
+            for match in HISTORY_RE.finditer(history_content):
+                item = match.group(match.lastindex)
+                found[HISTORY_GROUPS[match.lastindex]][item.decode('utf-8', 'ignore')] = None
+    
+    return _found_result(found)
+
+def _empty_result() -> Dict[str, Any]:
+    """Return the parse result of an empty history."""
+    return {
         "packages": {},
         "services": [],
         "users": []
     }
-    
-    # Extract packages by package manager
-    for pkg_manager, patterns in PACKAGE_PATTERNS.items():
-        result["packages"][pkg_manager] = find_matches(history_content, patterns)
-    
-    # Extract services
-    result["services"] = find_matches(history_content, SERVICE_PATTERNS)
-    
-    # Extract users
-    result["users"] = find_matches(history_content, USER_PATTERNS)
-    
-    return result
 
-def find_matches(lines: List[str], patterns: List[str]) -> List[str]:
+def _new_found() -> Dict[str, Dict[str, None]]:
+    """Return empty match collections, one per result key."""
+    return {key: {} for key in HISTORY_GROUPS.values()}
+
+def _found_result(found: Dict[str, Dict[str, None]]) -> Dict[str, Any]:
+    """Convert collected matches to the parse_bash_history result."""
+    return {
+        "packages": {pkg_manager: list(found[pkg_manager]) for pkg_manager in PACKAGE_PATTERNS},
+        "services": list(found["services"]),
+        "users": list(found["users"])
+    }
+
+def analyze_server_history(server_dir: str) -> Dict[str, Any]:
     """
-    Find matches in lines using regex patterns.
+    Analyze all bash histories in a server directory to identify services and configurations.
     
     Args:
-        lines: List of text lines to search
-        patterns: List of regex patterns to match
+        server_dir: Path to server directory containing user histories
         
     Returns:
-        List of unique matches
+        Dictionary with consolidated analysis
     """
-    matches = set()
-    
-    for line in lines:
-        line = line.strip()
-        for pattern in patterns:
-            match = re.search(pattern, line)
-            if match:
-                # Get the last group which should be the item name
-                item = match.group(match.lastindex or 1).strip()
-                if item:
-                    matches.add(item)
-    
-    return sorted(list(matches))
+    return analyze_server_history_fused(server_dir)
 
-def analyze_server_history(server_dir: str) -> Dict[str, Any]:
+def analyze_server_history_fused(server_dir: str) -> Dict[str, Any]:
     """
-    Analyze all bash histories in a server directory to identify services and configurations.
+    Analyze all bash histories in a server directory with a single regex scan.
+    
+    The histories are joined into one buffer, each preceded by a sentinel
+    line, so HISTORY_RE runs once over the whole server; every match is
+    attributed to the user whose history it falls in. The result is the same
+    as parsing each history with parse_bash_history and merging.
     
     Args:
         server_dir: Path to server directory containing user histories
@@ -123,6 +150,43 @@ def analyze_server_history(server_dir: str) -> Dict[str, Any]:
     if not os.path.exists(users_dir):
         return {}
     
+    # Read each user's history, noting where it starts in the joined buffer.
+    # The sentinel begins and ends with a newline, so no pattern can match
+    # across two histories.
+    chunks: List[bytes] = []
+    starts: List[int] = []
+    users: List[str] = []
+    empty: Set[str] = set()
+    offset = 0
+    with os.scandir(users_dir) as entries:
+        for entry in entries:
+            # Like os.path.isdir, a symlinked user directory is followed
+            if not entry.is_dir():
+                continue
+            
+            history_file = os.path.join(entry.path, "bash_history")
+            if not os.path.isfile(history_file):
+                continue
+            
+            with open(history_file, 'rb') as f:
+                history = f.read()
+            
+            sentinel = b"\n\0USER=%b\0\n" % entry.name.encode('utf-8', 'surrogateescape')
+            chunks.extend((sentinel, history))
+            offset += len(sentinel)
+            starts.append(offset)
+            users.append(entry.name)
+            offset += len(history)
+            if not history:
+                empty.add(entry.name)
+    
+    # Scan all histories at once
+    found_by_user = [_new_found() for _ in users]
+    for match in HISTORY_RE.finditer(b"".join(chunks)):
+        found = found_by_user[bisect.bisect_right(starts, match.start()) - 1]
+        item = match.group(match.lastindex)
+        found[HISTORY_GROUPS[match.lastindex]][item.decode('utf-8', 'ignore')] = None
+    
     server_analysis = {
         "packages": {},
         "services": set(),
@@ -130,28 +194,24 @@ def analyze_server_history(server_dir: str) -> Dict[str, Any]:
         "by_user": {}
     }
     
-    # Check each user's bash history
-    for user in os.listdir(users_dir):
-        user_dir = os.path.join(users_dir, user)
-        history_file = os.path.join(user_dir, "bash_history")
+    for user, found in zip(users, found_by_user):
+        # Empty histories keep the parse_bash_history result for empty files
+        user_analysis = _empty_result() if user in empty else _found_result(found)
         
-        if os.path.exists(history_file):
-            user_analysis = parse_bash_history(history_file)
-            
-            # Store user-specific analysis
-            server_analysis["by_user"][user] = user_analysis
-            
-            # Consolidate packages
-            for pkg_manager, packages in user_analysis["packages"].items():
-                if pkg_manager not in server_analysis["packages"]:
-                    server_analysis["packages"][pkg_manager] = set()
-                server_analysis["packages"][pkg_manager].update(packages)
-            
-            # Consolidate services
-            server_analysis["services"].update(user_analysis["services"])
-            
-            # Consolidate users
-            server_analysis["users_created"].update(user_analysis["users"])
+        # Store user-specific analysis
+        server_analysis["by_user"][user] = user_analysis
+        
+        # Consolidate packages
+        for pkg_manager, packages in user_analysis["packages"].items():
+            if pkg_manager not in server_analysis["packages"]:
+                server_analysis["packages"][pkg_manager] = set()
+            server_analysis["packages"][pkg_manager].update(packages)
+        
+        # Consolidate services
+        server_analysis["services"].update(user_analysis["services"])
+        
+        # Consolidate users
+        server_analysis["users_created"].update(user_analysis["users"])
     
     # Convert sets to sorted lists for clean output
     for pkg_manager in server_analysis["packages"]:
@@ -160,4 +220,4 @@ def analyze_server_history(server_dir: str) -> Dict[str, Any]:
     server_analysis["services"] = sorted(list(server_analysis["services"]))
     server_analysis["users_created"] = sorted(list(server_analysis["users_created"]))
     
-    return server_analysis
\ No newline at end of file
+    return server_analysis
@@ -3,15 +3,23 @@
 Restore management module for VPS Inventory, Backup & Restore.
 """
 import os
+import sys
 import json
 import yaml
 import shutil
+import logging
 import datetime
+from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
-from vps_ibr.utils.ssh import run_ssh_command, rsync_push
+from vps_ibr.utils.ssh import (
+    run_ssh_command, rsync_push, rsync_push_many, ssh_put_file, open_master_connection, close_mux
+)
 from vps_ibr.utils.file_utils import ensure_dir, load_json
 
+# Restoration progress; restore_server also writes it to the restore log
+logger = logging.getLogger(__name__)
+
 # Service-specific restore handlers
 SERVICE_RESTORE_HANDLERS = {
     "nginx": {
@@ -84,36 +92,68 @@ def restore_server(backup_dir: str, target_ip: str, ssh_key: Optional[str] = Non
     
     # Create restoration log
     log_file = os.path.join(backup_dir, "restore_log.txt")
-    with open(log_file, 'w') as f:
-        f.write(f"Restoration started: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Target server: {target_ip}\n")
-        f.write(f"Backup directory: {backup_dir}\n\n")
-    
-    # Restore system configurations first
-    system_restore_success = restore_system_configs(target_ip, ssh_key_path, backup_dir, log_file)
-    
-    # Restore services if available
-    services_dir = os.path.join(backup_dir, "services")
-    services_restored = []
+    log_header = "".join([
+        f"Restoration started: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+        f"Target server: {target_ip}\n",
+        f"Backup directory: {backup_dir}\n\n"
+    ])
+    Path(log_file).write_text(log_header)
     
-    if os.path.exists(services_dir):
-        for service in os.listdir(services_dir):
-            service_dir = os.path.join(services_dir, service)
-            if os.path.isdir(service_dir):
+    # Log progress to the restoration log for the rest of the run; the
+    # handler is opened once instead of reopening the file for every message.
+    # Progress is also printed when the application has not set up logging,
+    # and INFO messages are let through whatever level the caller left set.
+    handlers = []
+    if not logger.hasHandlers():
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(logging.INFO)
+        handlers.append(console_handler)
+    file_handler = logging.FileHandler(log_file, mode='a')
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    handlers.append(file_handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    previous_level = logger.level
+    if logger.getEffectiveLevel() > logging.INFO:
+        logger.setLevel(logging.INFO)
+    # Multiplex all restore commands and rsync runs over one connection
+    open_master_connection(target_ip, ssh_key_path)
+    try:
+        # Restore system configurations first
+        system_restore_success = restore_system_configs(target_ip, ssh_key_path, backup_dir)
+        
+        # Restore services if available
+        services_dir = os.path.join(backup_dir, "services")
+        services_restored = []
+        
+        if os.path.exists(services_dir):
+            with os.scandir(services_dir) as entries:
+                service_entries = [entry for entry in entries if entry.is_dir()]
+            
+            for entry in service_entries:
+                service = entry.name
                 service_success = restore_service(
-                    target_ip, ssh_key_path, service, service_dir, log_file
+                    target_ip, ssh_key_path, service, entry.path
                 )
                 if service_success:
                     services_restored.append(service)
-    
-    # Restore user home directories
-    homes_dir = os.path.join(backup_dir, "homes")
-    users_restored = []
-    
-    if os.path.exists(homes_dir):
-        for user in os.listdir(homes_dir):
-            user_dir = os.path.join(homes_dir, user)
-            if os.path.isdir(user_dir):
+        
+        # Restore user home directories
+        homes_dir = os.path.join(backup_dir, "homes")
+        users_restored = []
+        
+        if os.path.exists(homes_dir):
+            # Homes named after their user are pushed with one rsync per parent
+            # directory, keyed by that directory; others are pushed one by one
+            by_parent: Dict[str, List[str]] = {}
+            
+            with os.scandir(homes_dir) as entries:
+                user_entries = [entry for entry in entries if entry.is_dir()]
+            
+            for entry in user_entries:
+                user = entry.name
+                
                 # Ensure user exists
                 create_user_cmd = f"id {user} >/dev/null 2>&1 || useradd -m {user}"
                 run_ssh_command(target_ip, ssh_key_path, create_user_cmd)
@@ -124,45 +164,55 @@ def restore_server(backup_dir: str, target_ip: str, ssh_key: Optional[str] = Non
                 
                 if home_dir:
                     # Restore home directory
-                    log_message(log_file, f"Restoring home directory for user {user}")
-                    rsync_push(target_ip, ssh_key_path, f"{user_dir}/", f"{home_dir}/")
+                    logger.info("Restoring home directory for user %s", user)
+                    parent, name = os.path.split(home_dir.rstrip('/'))
+                    if name == user:
+                        by_parent.setdefault(parent, []).append(f"{user}/")
+                    else:
+                        rsync_push(
+                            target_ip, ssh_key_path, f"{entry.path}/", f"{home_dir}/",
+                            numeric_ids=False
+                        )
                     users_restored.append(user)
+            
+            # Owners are mapped by name, as users created by useradd may have
+            # other IDs on the target than on the backed-up server
+            for parent, users in by_parent.items():
+                rsync_push_many(
+                    target_ip, ssh_key_path, homes_dir, users, f"{parent.rstrip('/')}/",
+                    numeric_ids=False
+                )
+    finally:
+        logger.setLevel(previous_level)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        file_handler.close()
+        
+        # All restore commands shared one multiplexed connection; release it
+        close_mux(target_ip)
+    
+    # Complete the restore log, built in memory and appended at once
+    parts = [
+        "\nRestoration completed.\n",
+        f"Completed: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n",
+        "Services restored:\n"
+    ]
+    parts.extend(f"  - {service}\n" for service in services_restored)
+    parts.append("\n")
+    
+    parts.append("Users restored:\n")
+    parts.extend(f"  - {user}\n" for user in users_restored)
     
-    # Complete the restore log
     with open(log_file, 'a') as f:
-        f.write("\nRestoration completed.\n")
-        f.write(f"Completed: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        
-        f.write("Services restored:\n")
-        for service in services_restored:
-            f.write(f"  - {service}\n")
-        f.write("\n")
-        
-        f.write("Users restored:\n")
-        for user in users_restored:
-            f.write(f"  - {user}\n")
+        f.write("".join(parts))
     
     print(f"\nRestoration completed. See {log_file} for details.")
     return True
 
-def log_message(log_file: str, message: str) -> None:
-    """
-    Add a message to the restoration log.
-    
-    Args:
-        log_file: Path to log file
-        message: Message to log
-    """
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(log_file, 'a') as f:
-        f.write(f"[{timestamp}] {message}\n")
-    print(message)
-
 def restore_system_configs(
     target_ip: str, 
     ssh_key_path: str, 
-    backup_dir: str, 
-    log_file: str
+    backup_dir: str
 ) -> bool:
     """
     Restore system configuration files.
@@ -171,29 +221,31 @@ def restore_system_configs(
         target_ip: Target server IP
         ssh_key_path: Path to SSH key
         backup_dir: Path to backup directory
-        log_file: Path to log file
         
     Returns:
         True if successful, False otherwise
     """
     system_dir = os.path.join(backup_dir, "system")
     if not os.path.exists(system_dir):
-        log_message(log_file, "No system configuration backup found, skipping")
+        logger.info("No system configuration backup found, skipping")
         return False
     
-    log_message(log_file, "Restoring system configurations")
+    logger.info("Restoring system configurations")
+    
+    # system/ mirrors the server's /, so all paths go in a single rsync run
+    paths = []
     
     # Restore /etc directory
-    etc_dir = os.path.join(system_dir, "etc")
-    if os.path.exists(etc_dir):
-        log_message(log_file, "  Restoring /etc directory")
-        rsync_push(target_ip, ssh_key_path, f"{etc_dir}/", "/etc/")
+    if os.path.exists(os.path.join(system_dir, "etc")):
+        logger.info("  Restoring /etc directory")
+        paths.append("etc/")
     
     # Restore cron jobs
-    cron_dir = os.path.join(system_dir, "var/spool/cron")
-    if os.path.exists(cron_dir):
-        log_message(log_file, "  Restoring cron jobs")
-        rsync_push(target_ip, ssh_key_path, f"{cron_dir}/", "/var/spool/cron/")
+    if os.path.exists(os.path.join(system_dir, "var/spool/cron")):
+        logger.info("  Restoring cron jobs")
+        paths.append("var/spool/cron/")
+    
+    rsync_push_many(target_ip, ssh_key_path, system_dir, paths, numeric_ids=False)
     
     return True
 
@@ -201,8 +253,7 @@ def restore_service(
     target_ip: str, 
     ssh_key_path: str, 
     service: str, 
-    service_dir: str, 
-    log_file: str
+    service_dir: str
 ) -> bool:
     """
     Restore a specific service.
@@ -212,12 +263,11 @@ def restore_service(
         ssh_key_path: Path to SSH key
         service: Service name
         service_dir: Path to service backup directory
-        log_file: Path to log file
         
     Returns:
         True if successful, False otherwise
     """
-    log_message(log_file, f"Restoring service: {service}")
+    logger.info("Restoring service: %s", service)
     
     # Check if we have a handler for this service
     handler = SERVICE_RESTORE_HANDLERS.get(service)
@@ -225,28 +275,29 @@ def restore_service(
     # Run pre-restore command if available
     if handler and "pre_restore_cmd" in handler:
         pre_cmd = handler["pre_restore_cmd"]
-        log_message(log_file, f"  Running pre-restore command: {pre_cmd}")
+        logger.info("  Running pre-restore command: %s", pre_cmd)
         run_ssh_command(target_ip, ssh_key_path, pre_cmd)
     
-    # Restore files directory
+    # Restore files directory; it mirrors the server's /, so all paths of the
+    # service go in a single rsync run
     files_dir = os.path.join(service_dir, "files")
     if os.path.exists(files_dir):
+        paths = []
         if handler and "paths" in handler:
             # Restore to specific paths
             for path in handler["paths"]:
-                src_path = os.path.join(files_dir, path.lstrip('/'))
-                if os.path.exists(src_path):
-                    log_message(log_file, f"  Restoring {path}")
-                    rsync_push(target_ip, ssh_key_path, f"{src_path}/", f"{path}/")
+                if os.path.exists(os.path.join(files_dir, path.lstrip('/'))):
+                    logger.info("  Restoring %s", path)
+                    paths.append(path.lstrip('/'))
         else:
             # No specific paths, try to infer from directory structure
             for item in os.listdir(files_dir):
                 if os.path.isdir(os.path.join(files_dir, item)):
                     # Assume top-level directories in files_dir correspond to system directories
-                    src_path = os.path.join(files_dir, item)
-                    dst_path = f"/{item}/"
-                    log_message(log_file, f"  Restoring {dst_path}")
-                    rsync_push(target_ip, ssh_key_path, f"{src_path}/", dst_path)
+                    logger.info("  Restoring /%s/", item)
+                    paths.append(f"{item}/")
+        
+        rsync_push_many(target_ip, ssh_key_path, files_dir, paths, numeric_ids=False)
     
     # Restore specific files if defined in handler
     if handler and "files" in handler:
@@ -256,31 +307,9 @@ def restore_service(
             src_path = os.path.join(service_dir, src)
             
             if os.path.exists(src_path):
-                log_message(log_file, f"  Copying file {src} to {dst}")
-                # Ensure directory exists
-                dst_dir = os.path.dirname(dst)
-                run_ssh_command(target_ip, ssh_key_path, f"mkdir -p {dst_dir}")
-                
-                # Use SCP to copy the file
-                with open(src_path, 'rb') as f:
-                    content = f.read()
-                    
-                # Temporary file approach
-                tmp_path = f"/tmp/{os.path.basename(dst)}"
-                with open("/tmp/temp_file", 'wb') as f:
-                    f.write(content)
-                
-                # Using SCP to copy to the server
-                subprocess.run(
-                    ["scp", "-i", ssh_key_path, "/tmp/temp_file", f"root@{target_ip}:{tmp_path}"],
-                    check=False
-                )
-                
-                # Move to final destination
-                run_ssh_command(target_ip, ssh_key_path, f"mv {tmp_path} {dst}")
-                
-                # Clean up
-                os.remove("/tmp/temp_file")
+                logger.info("  Copying file %s to %s", src, dst)
+                # Stream the file over SSH; the directory is created as needed
+                ssh_put_file(target_ip, ssh_key_path, src_path, dst)
     
     # Install package if needed
     install_cmd = None
@@ -300,17 +329,17 @@ def restore_service(
                 install_cmd = f"yum install -y {service}"
     
     if install_cmd:
-        log_message(log_file, f"  Installing {service}: {install_cmd}")
+        logger.info("  Installing %s: %s", service, install_cmd)
         run_ssh_command(target_ip, ssh_key_path, install_cmd)
     
     # Run post-restore command if available
     if handler and "post_restore_cmd" in handler:
         post_cmd = handler["post_restore_cmd"]
-        log_message(log_file, f"  Running post-restore command: {post_cmd}")
+        logger.info("  Running post-restore command: %s", post_cmd)
         run_ssh_command(target_ip, ssh_key_path, post_cmd)
     elif handler and "restart_cmd" in handler:
         restart_cmd = handler["restart_cmd"]
-        log_message(log_file, f"  Restarting service: {restart_cmd}")
+        logger.info("  Restarting service: %s", restart_cmd)
         run_ssh_command(target_ip, ssh_key_path, restart_cmd)
     
     return True
\ No newline at end of file
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Console output helpers for VPS Inventory, Backup & Restore.
+"""
+import threading
+
+# Serializes console output from concurrent workers across all modules
+_print_lock = threading.Lock()
+
+def safe_print(*args, **kwargs) -> None:
+    """
+    Print while holding the shared print lock.
+    
+    Servers are inventoried and backed up by concurrent workers; printing
+    under one lock keeps their lines from interleaving.
+    """
+    with _print_lock:
+        print(*args, **kwargs)
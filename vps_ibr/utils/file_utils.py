@@ -3,12 +3,29 @@
 File utility functions for VPS Inventory, Backup & Restore.
 """
 import os
+import re
+import fnmatch
 import shutil
 import json
 import yaml
 from typing import Dict, Any, List, Optional, Union
 from datetime import datetime
 
+# orjson is an optional, much faster JSON encoder and decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Prefer the libyaml-backed dumper when PyYAML was built with it
+try:
+    from yaml import CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeDumper as _SafeDumper
+
+# Server directory names: <ip>-<YYYYMMDD>
+_IP_DIR_RE = re.compile(r'^(\d{1,3}(?:\.\d{1,3}){3})-\d{8}$')
+
 def ensure_dir(path: str) -> str:
     """
     Ensure a directory exists, creating it if necessary.
@@ -54,13 +71,29 @@ def save_json(data: Dict[str, Any], filepath: str, indent: int = 2) -> bool:
         # Ensure directory exists
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=indent)
+        # Serialize first so the file is written in one call
+        content = _dumps_json(data, indent)
+        with open(filepath, 'wb') as f:
+            f.write(content)
         return True
     except Exception as e:
         print(f"Error saving JSON file {filepath}: {e}")
         return False
 
+def _dumps_json(data: Any, indent: Optional[int]) -> bytes:
+    """
+    Serialize data to UTF-8 JSON, using orjson when available.
+    
+    orjson only supports two-space indentation, so other indent levels use
+    the standard library encoder.
+    """
+    if orjson is not None and indent in (None, 0, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, indent=indent).encode('utf-8')
+
 def load_json(filepath: str) -> Optional[Dict[str, Any]]:
     """
     Load data from JSON file.
@@ -72,8 +105,11 @@ def load_json(filepath: str) -> Optional[Dict[str, Any]]:
         Loaded data or None if loading failed
     """
     try:
-        with open(filepath, 'r') as f:
-            return json.load(f)
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        if orjson is not None:
+            return orjson.loads(content)
+        return json.loads(content)
     except Exception as e:
         print(f"Error loading JSON file {filepath}: {e}")
         return None
@@ -94,7 +130,7 @@ def save_yaml(data: Dict[str, Any], filepath: str) -> bool:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
         with open(filepath, 'w') as f:
-            yaml.dump(data, f, default_flow_style=False)
+            yaml.dump(data, f, Dumper=_SafeDumper, default_flow_style=False)
         return True
     except Exception as e:
         print(f"Error saving YAML file {filepath}: {e}")
@@ -107,22 +143,25 @@ def copy_directory(src: str, dst: str, exclude: List[str] = None) -> bool:
     Args:
         src: Source directory
         dst: Destination directory
-        exclude: List of patterns to exclude
+        exclude: List of patterns to exclude; glob patterns (e.g. "*.log")
+            match whole names, other patterns match any name containing them
         
     Returns:
         True if successful, False otherwise
     """
     try:
+        # Compile all exclude patterns into one regex; plain names keep
+        # matching anywhere in a name, glob patterns match the whole name
+        exclude_re = None
+        if exclude:
+            globs = [p if any(c in p for c in "*?[") else f"*{p}*" for p in exclude]
+            exclude_re = re.compile("|".join(fnmatch.translate(g) for g in globs))
+        
         # Convert exclude patterns to function for filtering
         def filter_func(src, names):
-            if not exclude:
+            if exclude_re is None:
                 return []
-            excluded = set()
-            for name in names:
-                for pattern in exclude:
-                    if pattern in name:
-                        excluded.add(name)
-            return excluded
+            return {name for name in names if exclude_re.match(name)}
         
         # Copy directory
         shutil.copytree(src, dst, ignore=filter_func, dirs_exist_ok=True)
@@ -144,17 +183,13 @@ def find_servers_in_backup(backup_dir: str) -> List[str]:
     if not os.path.exists(backup_dir):
         return []
     
-    servers = []
-    
-    # Look for directories matching IP-date pattern
-    ip_pattern = r'\d+\.\d+\.\d+\.\d+-\d+'
-    
-    for item in os.listdir(backup_dir):
-        item_path = os.path.join(backup_dir, item)
-        if os.path.isdir(item_path) and '-' in item:
-            # Extract IP from directory name
-            ip = item.split('-')[0]
-            if all(part.isdigit() for part in ip.split('.')):
-                servers.append(ip)
+    # Look for directories matching IP-date pattern; a server backed up on
+    # several days is listed once
+    with os.scandir(backup_dir) as entries:
+        servers = [
+            match.group(1)
+            for entry in entries
+            if (match := _IP_DIR_RE.match(entry.name)) and entry.is_dir()
+        ]
     
-    return servers
\ No newline at end of file
+    return list(dict.fromkeys(servers))
\ No newline at end of file
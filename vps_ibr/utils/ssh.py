@@ -3,17 +3,453 @@
 SSH utility functions for VPS Inventory, Backup & Restore.
 """
 import os
+import re
+import time
+import socket
+import atexit
+import logging
+import asyncio
+import concurrent.futures
+import functools
+import contextlib
+import shlex
+import secrets
+import select
+import selectors
 import subprocess
 import tempfile
+import threading
 import shutil
-from typing import Optional, Union, List
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Union, List, Tuple
+
+from vps_ibr.utils import ssh_pool
+
+# SSH and transfer failures, one record each with the server it concerns
+logger = logging.getLogger(__name__)
+
+# SFTP downloads use asyncssh when it is installed, scp otherwise
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+# Directory of the SSH control sockets, private to the local user
+_MUX_DIR = os.path.join(
+    tempfile.gettempdir(), f"vps-ibr-{os.getuid()}" if hasattr(os, "getuid") else "vps-ibr"
+)
+
+# Persist idle master connections this long after their last client exits
+_MUX_PERSIST = "10m"
+
+def _mux_control_path() -> str:
+    """
+    Return the ControlPath pattern for SSH multiplexing.
+    
+    The socket directory is created on first use with 0700 permissions, as
+    anyone able to open a control socket can use its connection.
+    """
+    os.makedirs(_MUX_DIR, mode=0o700, exist_ok=True)
+    if os.stat(_MUX_DIR).st_mode & 0o077:
+        os.chmod(_MUX_DIR, 0o700)
+    # ssh expands the tokens, giving one socket per user, host and port. %n
+    # is the host as given on the command line, which stays the same when
+    # HostName points ssh at a resolved address (see _ssh_opts).
+    return os.path.join(_MUX_DIR, "%r@%n:%p")
+
+def _resolve(host: str) -> Tuple[str, str]:
+    """
+    Resolve a server address once per run.
+    
+    Only successful lookups are remembered, so a transient resolver error
+    does not make the server unreachable for the rest of the run.
+    
+    Args:
+        host: Server IP address or host name
+        
+    Returns:
+        Tuple of the numeric address and its ssh AddressFamily ("inet" or
+        "inet6"); the host itself and "any" if it cannot be resolved, so that
+        ssh reports the error
+    """
+    try:
+        return _lookup(host)
+    except (OSError, UnicodeError):
+        return host, "any"
+
+@functools.lru_cache(maxsize=256)
+def _lookup(host: str) -> Tuple[str, str]:
+    """Resolve a server address for _resolve; failures raise and are not cached."""
+    family, _, _, _, sockaddr = socket.getaddrinfo(host, 22, proto=socket.IPPROTO_TCP)[0]
+    return sockaddr[0], "inet6" if family == socket.AF_INET6 else "inet"
+
+@functools.lru_cache(maxsize=256)
+def _key_path(ssh_key_path: str) -> str:
+    """Return the canonical path of an SSH key file, computed once per run."""
+    return os.path.realpath(ssh_key_path)
+
+@functools.lru_cache(maxsize=None)
+def _executable(name: str) -> str:
+    """
+    Return the absolute path of a program, looked up in PATH once per run.
+    
+    Together with close_fds=False, an absolute path lets subprocess start
+    children with posix_spawn instead of fork and exec, which does not copy
+    this process's page tables. Passing close_fds=False is safe, as Python
+    creates its file descriptors non-inheritable.
+    
+    Args:
+        name: Program name, e.g. "ssh"
+        
+    Returns:
+        Absolute path of the program, or the name itself if it is not found
+    """
+    return shutil.which(name) or name
+
+def _ssh_opts(ip: str, ssh_key_path: str, timeout: int) -> List[str]:
+    """
+    Return the ssh options used to log in to a server.
+    
+    The server address is resolved once and passed as HostName together
+    with its AddressFamily, so ssh skips its own name lookup.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        List of ssh options
+    """
+    address, family = _resolve(ip)
+    return [
+        "-i", _key_path(ssh_key_path), "-o", f"ConnectTimeout={timeout}",
+        "-o", "StrictHostKeyChecking=no",
+        "-o", f"HostName={address}", "-o", f"AddressFamily={family}"
+    ]
+
+def _ssh_mux_opts() -> List[str]:
+    """
+    Return the ssh options that multiplex connections to the same host.
+    
+    With ControlMaster=auto the first ssh, scp or rsync connection to a host
+    becomes the master and later ones reuse its socket instead of performing
+    their own TCP and SSH handshake. The master stays up for _MUX_PERSIST
+    after the last client exits.
+    """
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={_mux_control_path()}",
+        "-o", f"ControlPersist={_MUX_PERSIST}"
+    ]
+
+# Preferred SSH cipher for bulk traffic. AES-GCM is the fastest choice on
+# CPUs with AES-NI; on CPUs without it, chacha20-poly1305@openssh.com is
+# faster.
+DEFAULT_CIPHER = "aes128-gcm@openssh.com"
+
+# Ciphers and MACs offered after the preferred cipher, so servers that do
+# not allow it still connect. AEAD ciphers (GCM, chacha20) need no MAC; the
+# MACs only apply if a CTR cipher is negotiated.
+_FALLBACK_CIPHERS = [
+    "aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "chacha20-poly1305@openssh.com",
+    "aes128-ctr", "aes192-ctr", "aes256-ctr"
+]
+_MACS = ["umac-64-etm@openssh.com", "hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"]
+
+def _ssh_cipher_opts(cipher: str = DEFAULT_CIPHER) -> List[str]:
+    """
+    Return the ssh options that tune a connection for throughput.
+    
+    With multiplexing, a connection is encrypted as negotiated by its master,
+    so these options take effect where the master is started.
+    
+    Args:
+        cipher: Preferred cipher, offered ahead of the fallbacks
+        
+    Returns:
+        List of ssh options
+    """
+    ciphers = ",".join(dict.fromkeys([cipher, *_FALLBACK_CIPHERS]))
+    return [
+        "-c", ciphers,
+        "-o", f"MACs={','.join(_MACS)}",
+        # rsync compresses itself when asked to; SSH compression only costs CPU
+        "-o", "Compression=no",
+        "-o", "IPQoS=throughput"
+    ]
+
+# Master connections held by callers of open_master_connection in this
+# process, by server, and the servers whose master this process started.
+# Only those are stopped, once their last holder calls close_mux, so
+# concurrent sessions to the same host never lose a shared master.
+_master_refs: Dict[str, int] = {}
+_owned_masters = set()
+_master_locks: Dict[str, threading.Lock] = {}
+_master_locks_lock = threading.Lock()
+
+def _master_lock(ip: str) -> threading.Lock:
+    """Return the lock serializing master connection changes for a server."""
+    with _master_locks_lock:
+        return _master_locks.setdefault(ip, threading.Lock())
+
+def open_master_connection(
+    ip: str,
+    ssh_key_path: str,
+    timeout: int = 30,
+    cipher: str = DEFAULT_CIPHER
+) -> Optional[str]:
+    """
+    Start the multiplexed SSH master connection to a server ahead of use.
+    
+    Connections are multiplexed automatically (see _ssh_mux_opts); opening
+    the master up front means that concurrent first calls to the same server
+    all share it, instead of racing to become the master. Every call must be
+    matched by a call to close_mux, whether or not it succeeded.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        timeout: Timeout in seconds for the SSH connection
+        cipher: Preferred cipher of the connection (see DEFAULT_CIPHER)
+        
+    Returns:
+        ControlPath pattern of the master, or None if it could not be started
+    """
+    control_path = _mux_control_path()
+    with _master_lock(ip):
+        _master_refs[ip] = _master_refs.get(ip, 0) + 1
+        if _master_refs[ip] > 1 and ip in _owned_masters:
+            return control_path
+        try:
+            # Reuse a master left running by an earlier call or invocation
+            check = subprocess.run(
+                [_executable("ssh"), "-o", f"ControlPath={control_path}",
+                 "-O", "check", f"root@{ip}"],
+                stdin=subprocess.DEVNULL, capture_output=True, check=False, close_fds=False
+            )
+            if check.returncode == 0:
+                return control_path
+            
+            # ssh -f backgrounds itself, so its output must not be captured
+            result = subprocess.run(
+                [_executable("ssh"), "-o", "ControlMaster=yes", "-o", f"ControlPath={control_path}",
+                 "-o", f"ControlPersist={_MUX_PERSIST}", "-Nf",
+                 *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_cipher_opts(cipher), f"root@{ip}"],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                check=False, close_fds=False
+            )
+        except Exception as e:
+            logger.error("Error opening master connection to %s: %s", ip, e)
+            return None
+        
+        if result.returncode != 0:
+            return None
+        _owned_masters.add(ip)
+        return control_path
+
+def close_mux(ip: str) -> None:
+    """
+    Release a master connection taken with open_master_connection.
+    
+    The master is stopped once its last holder in this process releases it,
+    and only if this process started it; a master started elsewhere, or on
+    demand by ControlMaster=auto, is left to expire after _MUX_PERSIST.
+    
+    Args:
+        ip: Server IP address
+    """
+    with _master_lock(ip):
+        refs = _master_refs.get(ip, 0) - 1
+        if refs > 0:
+            _master_refs[ip] = refs
+            return
+        _master_refs.pop(ip, None)
+        if ip not in _owned_masters:
+            return
+        _owned_masters.discard(ip)
+        try:
+            subprocess.run(
+                [_executable("ssh"), "-o", f"ControlPath={_mux_control_path()}",
+                 "-O", "exit", f"root@{ip}"],
+                stdin=subprocess.DEVNULL, capture_output=True, check=False, close_fds=False
+            )
+        except Exception as e:
+            logger.error("Error closing master connection to %s: %s", ip, e)
+
+# Delays in seconds before each retry of an SSH call that failed to connect;
+# with multiplexing, a retry reuses or restarts the master connection
+RETRY_BACKOFF = (0.2, 0.5, 1.0)
+
+# Messages ssh prints when it could not set up the connection at all, each at
+# the start of a line of its stderr; after any of these, no remote command ran
+_CONNECT_FAILURE = re.compile(
+    rb"^(?:ssh: connect to host |kex_exchange_identification: |ssh_exchange_identification: "
+    rb"|Connection closed by \S+ port \d+|Connection timed out during banner exchange)",
+    re.MULTILINE
+)
+
+def _is_transient(returncode: int, stderr: bytes) -> bool:
+    """
+    Return True if a failed ssh or scp call is worth retrying.
+    
+    Only calls that ssh reports as failing to connect (exit status 255 with
+    one of its connect-phase errors) are retried. A remote command may exit
+    with 255 itself, and a connection may drop once the command started;
+    neither is retried, so a command that may have run is never run again.
+    
+    Args:
+        returncode: Exit status of the ssh or scp process
+        stderr: Its captured stderr
+        
+    Returns:
+        True if the call should be retried
+    """
+    return returncode == 255 and _CONNECT_FAILURE.search(stderr) is not None
+
+# Largest combined stdout and stderr kept from a remote command; a command
+# producing more is killed rather than buffered
+MAX_OUTPUT_BYTES = 16 * 1024 * 1024
+
+# Bytes read from or written to a pipe at a time
+_PIPE_CHUNK = 65536
+
+def _communicate_capped(
+    proc: subprocess.Popen,
+    input: Optional[bytes],
+    max_output_bytes: int
+) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Feed input to a process and read its output, up to a size limit.
+    
+    stdin, stdout and stderr are serviced together from one selector, so
+    neither side can block the other on a full pipe. If the output exceeds
+    max_output_bytes, the process is killed.
+    
+    Args:
+        proc: Process started with stdout and stderr (and stdin, if input is
+            given) set to subprocess.PIPE
+        input: Bytes to write to the process's stdin, or None
+        max_output_bytes: Largest combined size of stdout and stderr
+        
+    Returns:
+        Tuple of stdout and stderr, or None if the output was too large
+    """
+    # Selectors only wait on sockets on Windows, not on pipes
+    if os.name != "posix":
+        return _communicate_capped_threads(proc, input, max_output_bytes)
+    
+    output = {proc.stdout.fileno(): bytearray(), proc.stderr.fileno(): bytearray()}
+    total = 0
+    offset = 0
+    
+    with selectors.DefaultSelector() as selector:
+        for fd in output:
+            selector.register(fd, selectors.EVENT_READ)
+        if input:
+            selector.register(proc.stdin.fileno(), selectors.EVENT_WRITE)
+        elif proc.stdin:
+            proc.stdin.close()
+        
+        while selector.get_map():
+            for key, _ in selector.select():
+                if key.events & selectors.EVENT_WRITE:
+                    # Writes of at most PIPE_BUF bytes do not block once the
+                    # pipe is writable
+                    try:
+                        offset += os.write(key.fd, input[offset:offset + select.PIPE_BUF])
+                    except BrokenPipeError:
+                        offset = len(input)
+                    if offset >= len(input):
+                        selector.unregister(key.fd)
+                        proc.stdin.close()
+                    continue
+                
+                chunk = os.read(key.fd, _PIPE_CHUNK)
+                if not chunk:
+                    selector.unregister(key.fd)
+                    continue
+                total += len(chunk)
+                if total > max_output_bytes:
+                    proc.kill()
+                    proc.wait()
+                    return None
+                output[key.fd] += chunk
+    
+    proc.wait()
+    return bytes(output[proc.stdout.fileno()]), bytes(output[proc.stderr.fileno()])
+
+def _communicate_capped_threads(
+    proc: subprocess.Popen,
+    input: Optional[bytes],
+    max_output_bytes: int
+) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Same as _communicate_capped, with one thread per pipe instead of a selector.
+    
+    Args:
+        proc: Process started as for _communicate_capped
+        input: Bytes to write to the process's stdin, or None
+        max_output_bytes: Largest combined size of stdout and stderr
+        
+    Returns:
+        Tuple of stdout and stderr, or None if the output was too large
+    """
+    output = (bytearray(), bytearray())
+    total = 0
+    too_large = False
+    lock = threading.Lock()
+    
+    def read(stream, buffer: bytearray) -> None:
+        nonlocal total, too_large
+        while True:
+            chunk = stream.read1(_PIPE_CHUNK)
+            if not chunk:
+                return
+            with lock:
+                total += len(chunk)
+                if total > max_output_bytes:
+                    too_large = True
+                    proc.kill()
+                    return
+                buffer += chunk
+    
+    def write() -> None:
+        try:
+            proc.stdin.write(input)
+        except OSError:
+            # The command exited without reading all of its input
+            pass
+        finally:
+            with contextlib.suppress(OSError):
+                proc.stdin.close()
+    
+    threads = [
+        threading.Thread(target=read, args=(proc.stdout, output[0]), daemon=True),
+        threading.Thread(target=read, args=(proc.stderr, output[1]), daemon=True)
+    ]
+    if input:
+        threads.append(threading.Thread(target=write, daemon=True))
+    elif proc.stdin:
+        proc.stdin.close()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    proc.wait()
+    if too_large:
+        return None
+    return bytes(output[0]), bytes(output[1])
 
 def run_ssh_command(
     ip: str, 
     ssh_key_path: str, 
     command: str, 
-    timeout: int = 30
-) -> Optional[str]:
+    timeout: int = 30,
+    binary: bool = False,
+    input: Optional[str] = None,
+    max_output_bytes: int = MAX_OUTPUT_BYTES
+) -> Optional[Union[str, bytes]]:
     """
     Run a command on remote server via SSH and return output.
     
@@ -22,82 +458,918 @@ def run_ssh_command(
         ssh_key_path: Path to SSH key file
         command: Command to execute on the remote server
         timeout: Timeout in seconds for the SSH connection
+        binary: Return the raw, unstripped output bytes instead of text
+        input: Text fed to the command's stdin
+        max_output_bytes: Kill the command and fail once its stdout and stderr
+            together exceed this many bytes
         
     Returns:
-        Command output as string, or None if command failed
+        Command output as string (bytes if binary), or None if command failed
+    """
+    # Reuse a pooled Paramiko connection instead of spawning ssh
+    if ssh_pool.enabled():
+        return ssh_pool.run_ssh_command(
+            ip, ssh_key_path, command, timeout, binary, input, max_output_bytes
+        )
+    
+    return _run_ssh_argv(
+        ip, (*_ssh_base_argv(ip, ssh_key_path, timeout), command), binary, input, max_output_bytes
+    )
+
+def _ssh_base_argv(ip: str, ssh_key_path: str, timeout: int) -> Tuple[str, ...]:
+    """Return the ssh command line to a server, without the remote command."""
+    return (
+        _executable("ssh"), *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_mux_opts(), f"root@{ip}"
+    )
+
+def _run_ssh_argv(
+    ip: str,
+    ssh_command: Tuple[str, ...],
+    binary: bool,
+    input: Optional[str],
+    max_output_bytes: int
+) -> Optional[Union[str, bytes]]:
+    """
+    Run a complete ssh command line and return the remote command's output.
+    
+    This is the subprocess path of run_ssh_command; see there for the
+    arguments and result.
+    """
+    # The output is read as bytes and decoded only once the command
+    # succeeded, and not at all in binary mode
+    stdin_data = input.encode() if input is not None else None
+    for retry_delay in (*RETRY_BACKOFF, None):
+        try:
+            proc = subprocess.Popen(
+                ssh_command,
+                stdin=subprocess.PIPE if input is not None else None,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=False
+            )
+            with proc:
+                result = _communicate_capped(proc, stdin_data, max_output_bytes)
+        except Exception as e:
+            logger.error("Unexpected error while executing command on %s: %s", ip, e)
+            return None
+        
+        if result is None:
+            logger.error(
+                "Error executing command on %s: output exceeded %d bytes, command killed",
+                ip, max_output_bytes
+            )
+            return None
+        stdout, stderr = result
+        if proc.returncode == 0:
+            break
+        if retry_delay is None or not _is_transient(proc.returncode, stderr):
+            logger.error(
+                "Error executing command on %s: "
+                "Command returned non-zero exit status %d.\nstderr: %s",
+                ip, proc.returncode, stderr.decode('utf-8', errors='replace')
+            )
+            return None
+        logger.warning(
+            "Connection to %s failed, retrying in %.1fs: %s",
+            ip, retry_delay, stderr.decode('utf-8', errors='replace').strip()
+        )
+        time.sleep(retry_delay)
+    
+    if binary:
+        return stdout
+    return stdout.decode("utf-8", errors="replace").strip()
+
+def make_ssh_runner(
+    ip: str,
+    ssh_key_path: str,
+    timeout: int = 30
+) -> Callable[..., Optional[Union[str, bytes]]]:
+    """
+    Return a function that runs commands on one server.
+    
+    The ssh command line to the server is built once, so callers running
+    many commands on the same server do not rebuild (and re-check the
+    control socket directory for) every call. The returned function takes
+    the command plus the binary, input and max_output_bytes arguments of
+    run_ssh_command and behaves the same.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        Function running a command on the server and returning its output
+    """
+    base_argv = _ssh_base_argv(ip, ssh_key_path, timeout)
+    
+    def run(
+        command: str,
+        binary: bool = False,
+        input: Optional[str] = None,
+        max_output_bytes: int = MAX_OUTPUT_BYTES
+    ) -> Optional[Union[str, bytes]]:
+        if ssh_pool.enabled():
+            return ssh_pool.run_ssh_command(
+                ip, ssh_key_path, command, timeout, binary, input, max_output_bytes
+            )
+        return _run_ssh_argv(ip, base_argv + (command,), binary, input, max_output_bytes)
+    
+    return run
+
+async def run_ssh_command_async(
+    ip: str,
+    ssh_key_path: str,
+    command: str,
+    timeout: int = 30,
+    binary: bool = False
+) -> Optional[Union[str, bytes]]:
+    """
+    Run a command on remote server via SSH without blocking the event loop.
+    
+    Behaves like run_ssh_command, so many servers can be queried
+    concurrently from one thread (see fanout).
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        command: Command to execute on the remote server
+        timeout: Timeout in seconds for the SSH connection
+        binary: Return the raw, unstripped output bytes instead of text
+        
+    Returns:
+        Command output as string (bytes if binary), or None if command failed
     """
     try:
-        result = subprocess.run(
-            ["ssh", "-i", ssh_key_path, "-o", f"ConnectTimeout={timeout}", 
-             "-o", "StrictHostKeyChecking=no", f"root@{ip}", command],
-            capture_output=True, text=True, check=True
+        proc = await asyncio.create_subprocess_exec(
+            _executable("ssh"), *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_mux_opts(),
+            f"root@{ip}", command,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            close_fds=False
         )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command on {ip}: {e}")
-        print(f"stderr: {e.stderr}")
+        stdout, stderr = await proc.communicate()
+    except Exception as e:
+        logger.error("Unexpected error while executing command on %s: %s", ip, e)
         return None
-    except subprocess.TimeoutExpired:
-        print(f"Timeout while connecting to {ip}")
+    
+    if proc.returncode != 0:
+        logger.error(
+            "Error executing command on %s: Command returned non-zero exit status %d.\nstderr: %s",
+            ip, proc.returncode, stderr.decode(errors='replace')
+        )
         return None
+    if binary:
+        return stdout
+    return stdout.decode(errors='replace').strip()
+
+async def fanout(
+    ips: List[str],
+    fn: Callable[..., Awaitable[Any]],
+    *args: Any,
+    concurrency: int = 32,
+    **kwargs: Any
+) -> List[Any]:
+    """
+    Run a coroutine function for many servers concurrently.
+    
+    fn is called as fn(ip, *args, **kwargs) for every IP, with at most
+    concurrency calls in flight, so the total time is close to that of the
+    slowest server instead of the sum over all of them. Run it with
+    asyncio.run, e.g.:
+    
+        outputs = asyncio.run(fanout(ips, run_ssh_command_async, key, "uptime"))
+        
+    Args:
+        ips: Server IP addresses
+        fn: Coroutine function taking the IP as first argument
+        *args: Further positional arguments for fn
+        concurrency: Maximum number of concurrent calls
+        **kwargs: Keyword arguments for fn
+        
+    Returns:
+        Result of each call in the order of ips; a call that raised gives
+        its exception instead
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    
+    async def limited(ip: str) -> Any:
+        async with semaphore:
+            return await fn(ip, *args, **kwargs)
+    
+    return await asyncio.gather(*(limited(ip) for ip in ips), return_exceptions=True)
+
+def run_ssh_commands_batch(
+    ip: str,
+    ssh_key_path: str,
+    commands: List[str],
+    sep: Optional[str] = None,
+    timeout: int = 30,
+    parallel: bool = False
+) -> List[Optional[str]]:
+    """
+    Run several independent commands on a server in a single SSH call.
+    
+    The commands are written into one script that is piped to bash -s on
+    the server, so all of them cost a single round trip, and they are not
+    limited by the length or quoting of the ssh command line. A separator
+    line carrying the exit status follows each command's output, so the
+    output can be split back per command locally. Each command's stdin is
+    /dev/null, so it cannot consume the rest of the script.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        commands: Shell commands to run
+        sep: Separator line marker; must not appear in any command's output.
+            By default a random one is generated for each call, so no output
+            can fake it.
+        timeout: Timeout in seconds for the SSH connection
+        parallel: Run the commands concurrently on the server; only for
+            commands that do not depend on each other
+        
+    Returns:
+        Output of each command (stdout and stderr), in the order of commands,
+        or None for a command that failed
+    """
+    if not commands:
+        return []
+    
+    if sep is None:
+        sep = f"___VPS_IBR_SEP_{secrets.token_hex(16)}___"
+    marker = f"printf '\\n%s:%s\\n' {shlex.quote(sep)}"
+    lines = []
+    if parallel:
+        # Start every command in the background with its output and exit
+        # status in a temp dir, then print them in order once all are done
+        lines.append('d=$(mktemp -d) || exit 1')
+        for i, command in enumerate(commands):
+            lines.append(
+                f'{{ (\n{command}\n) </dev/null >"$d/{i}" 2>&1; '
+                f'echo $? >"$d/{i}.rc"; }} &'
+            )
+        lines.append('wait')
+        for i in range(len(commands)):
+            lines.append(f'cat "$d/{i}"; {marker} "$(cat "$d/{i}.rc")"')
+        lines.append('rm -rf "$d"')
+    else:
+        # Each command runs in a subshell, so an exit in it ends only that
+        # command and not the whole script
+        for command in commands:
+            lines.append(f'(\n{command}\n) </dev/null 2>&1; {marker} "$?"')
+    lines.append('exit 0')
+    
+    results: List[Optional[str]] = [None] * len(commands)
+    output = run_ssh_command(ip, ssh_key_path, "bash -s", timeout, input="\n".join(lines) + "\n")
+    if output is None:
+        return results
+    
+    # The output was stripped, so the first separator has no leading newline
+    start = 0
+    separators = re.finditer(rf"(?:^|\n){re.escape(sep)}:(\d+)(?:\n|$)", output)
+    for i, match in zip(range(len(commands)), separators):
+        if match.group(1) == "0":
+            results[i] = output[start:match.start()].strip()
+        start = match.end()
+    
+    return results
+
+# SFTP block size and number of concurrent block reads per download
+SFTP_BLOCK_SIZE = 32768
+SFTP_MAX_REQUESTS = 128
+
+class SFTPSession:
+    """
+    SFTP client on one asyncssh connection, shared by many downloads.
+    
+    A single SFTP channel serves any number of concurrent get calls, each
+    keeping SFTP_MAX_REQUESTS block reads in flight. Use it as an async
+    context manager, e.g.:
+    
+        async with SFTPSession(ip, key) as sftp:
+            copied = await sftp.get_many([(remote_path, local_path), ...])
+    """
+    
+    def __init__(self, ip: str, ssh_key_path: str, timeout: int = 30):
+        """
+        Initialize SFTP session.
+        
+        Args:
+            ip: Server IP address
+            ssh_key_path: Path to SSH key file
+            timeout: Timeout in seconds for the SSH connection
+        """
+        self.ip = ip
+        self.ssh_key_path = ssh_key_path
+        self.timeout = timeout
+        self._conn = None
+        self._sftp = None
+    
+    async def __aenter__(self) -> "SFTPSession":
+        # known_hosts=None matches StrictHostKeyChecking=no
+        self._conn = await asyncssh.connect(
+            self.ip, username="root", client_keys=[self.ssh_key_path], known_hosts=None,
+            connect_timeout=self.timeout
+        )
+        try:
+            self._sftp = await self._conn.start_sftp_client()
+        except BaseException:
+            self._conn.close()
+            raise
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+    
+    @property
+    def closed(self) -> bool:
+        """True once the connection is closed or has dropped."""
+        return self._conn is None or self._conn.is_closed()
+    
+    async def get(
+        self,
+        remote_path: str,
+        local_path: str,
+        progress_handler: Optional[Callable[..., None]] = None
+    ) -> bool:
+        """
+        Download a file.
+        
+        Args:
+            remote_path: Path to file on remote server
+            local_path: Path to save file locally
+            progress_handler: Called as blocks arrive, with the paths, the
+                bytes copied so far and the file size
+            
+        Returns:
+            True if file was downloaded, False otherwise
+        """
+        try:
+            await self._sftp.get(
+                remote_path, local_path,
+                block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS,
+                progress_handler=progress_handler
+            )
+            return True
+        except (OSError, asyncssh.Error):
+            return False
+    
+    async def get_many(self, pairs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Download several files concurrently over the same SFTP channel.
+        
+        Args:
+            pairs: (remote_path, local_path) of each file
+            
+        Returns:
+            For each pair, True if the file was downloaded, False otherwise
+        """
+        return list(await asyncio.gather(*(self.get(remote, local) for remote, local in pairs)))
+    
+    def abort(self) -> None:
+        """Drop the connection at once, without waiting on the server."""
+        if self._conn is not None:
+            self._conn.abort()
+            self._conn = None
+            self._sftp = None
+    
+    async def close(self) -> None:
+        """Close the SFTP client and its connection."""
+        if self._sftp is not None:
+            self._sftp.exit()
+            self._sftp = None
+        if self._conn is not None:
+            self._conn.close()
+            await self._conn.wait_closed()
+            self._conn = None
+
+# Sessions used by scp_get_file, by (ip, ssh_key_path). They live on one
+# event loop running in a background thread, so synchronous callers in any
+# thread share them; they are only touched from that loop.
+_sftp_sessions: Dict[Tuple[str, str], "asyncio.Task[SFTPSession]"] = {}
+_sftp_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_sftp_event_loop_lock = threading.Lock()
+
+def _sftp_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of the cached SFTP sessions, starting it on first use."""
+    global _sftp_event_loop
+    with _sftp_event_loop_lock:
+        if _sftp_event_loop is None:
+            _sftp_event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_sftp_event_loop.run_forever, name="vps-ibr-sftp", daemon=True
+            ).start()
+        return _sftp_event_loop
+
+async def _cached_sftp_session(ip: str, ssh_key_path: str, timeout: int) -> SFTPSession:
+    """
+    Return the cached SFTP session for a server, connecting it if needed.
+    
+    Concurrent first calls wait on the same connection attempt, and a
+    session whose connection has dropped is replaced by a new one.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        Connected session
+    """
+    key = (ip, ssh_key_path)
+    task = _sftp_sessions.get(key)
+    if task is not None and task.done():
+        if task.cancelled() or task.exception() is not None or task.result().closed:
+            task = None
+    if task is None:
+        task = asyncio.ensure_future(SFTPSession(ip, ssh_key_path, timeout).__aenter__())
+        _sftp_sessions[key] = task
+    return await asyncio.shield(task)
+
+async def _evict_sftp_session(ip: str, ssh_key_path: str) -> None:
+    """
+    Drop the cached SFTP session for a server, so the next call reconnects.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+    """
+    task = _sftp_sessions.pop((ip, ssh_key_path), None)
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        task.result().abort()
+
+async def _close_sftp_sessions() -> None:
+    """Close every cached SFTP session."""
+    tasks = list(_sftp_sessions.values())
+    _sftp_sessions.clear()
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is None:
+            await task.result().close()
+
+@atexit.register
+def close_sftp_sessions(timeout: int = 5) -> None:
+    """
+    Close the SFTP sessions cached by scp_get_file.
+    
+    Args:
+        timeout: Seconds to wait for the connections to close
+    """
+    if _sftp_event_loop is None:
+        return
+    future = asyncio.run_coroutine_threadsafe(_close_sftp_sessions(), _sftp_event_loop)
+    try:
+        future.result(timeout)
     except Exception as e:
-        print(f"Unexpected error while executing command on {ip}: {e}")
-        return None
+        logger.warning("Error closing SFTP sessions: %s", e)
+
+async def _sftp_get(
+    ip: str,
+    ssh_key_path: str,
+    remote_path: str,
+    local_path: str,
+    timeout: int = 30,
+    progress_handler: Optional[Callable[..., None]] = None
+) -> bool:
+    """
+    Download a file over the cached SFTP session for a server.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        remote_path: Path to file on remote server
+        local_path: Path to save file locally
+        timeout: Timeout in seconds for the SSH connection
+        progress_handler: Called as blocks arrive (see SFTPSession.get)
+        
+    Returns:
+        True if file was downloaded, False otherwise
+    """
+    try:
+        session = await _cached_sftp_session(ip, ssh_key_path, timeout)
+    except (OSError, asyncssh.Error):
+        return False
+    return await session.get(remote_path, local_path, progress_handler)
+
+def _sftp_get_blocking(
+    ip: str,
+    ssh_key_path: str,
+    remote_path: str,
+    local_path: str,
+    timeout: int = 30
+) -> bool:
+    """
+    Download a file over the cached SFTP session and wait for it.
+    
+    The download may take as long as data keeps arriving. If connecting or
+    the transfer makes no progress for timeout seconds, the download is
+    cancelled and the server's session is dropped from the cache, so a
+    stalled connection cannot block the caller or later calls.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        remote_path: Path to file on remote server
+        local_path: Path to save file locally
+        timeout: Seconds without progress after which the download fails
+        
+    Returns:
+        True if file was downloaded, False otherwise
+    """
+    last_progress = time.monotonic()
+    
+    def progress_handler(*_) -> None:
+        nonlocal last_progress
+        last_progress = time.monotonic()
+    
+    future = asyncio.run_coroutine_threadsafe(
+        _sftp_get(ip, ssh_key_path, remote_path, local_path, timeout, progress_handler),
+        _sftp_loop()
+    )
+    while True:
+        remaining = last_progress + timeout - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return future.result(remaining)
+        except concurrent.futures.TimeoutError:
+            pass
+    
+    if not future.cancel():
+        # Finished just now
+        return future.result()
+    asyncio.run_coroutine_threadsafe(_evict_sftp_session(ip, ssh_key_path), _sftp_loop())
+    logger.error("Timeout while copying file from %s:%s", ip, remote_path)
+    return False
+
+def _has_expected_size(path: str, expected_size: Optional[int]) -> bool:
+    """
+    Check a downloaded file's size with a single stat call.
+    
+    Args:
+        path: Path of the downloaded file
+        expected_size: Size the file must have, or None to accept any
+            non-empty file
+        
+    Returns:
+        True if the file exists and has the expected size
+    """
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return False
+    return size == expected_size if expected_size is not None else size > 0
 
 def scp_get_file(
     ip: str, 
     ssh_key_path: str, 
     remote_path: str, 
     local_path: str, 
-    timeout: int = 30
+    timeout: int = 30,
+    expected_size: Optional[int] = None
 ) -> bool:
     """
     Copy a file from remote server using SCP.
     
+    If asyncssh is installed, SFTP is used instead: it keeps many block
+    reads in flight at once, where SCP waits on a single stream, which is
+    much faster for larger files on high-latency links. The SFTP session
+    of each server is kept open and shared by later and concurrent calls.
+    
     Args:
         ip: Server IP address
         ssh_key_path: Path to SSH key file
         remote_path: Path to file on remote server
         local_path: Path to save file locally
         timeout: Timeout in seconds for the SSH connection
+        expected_size: Size of the remote file, if known; the copy then only
+            succeeds with exactly this size. Otherwise an empty file counts
+            as not copied.
         
     Returns:
         True if file was copied successfully, False otherwise
     """
-    # Create a temporary file
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_path = temp_file.name
+    # Reuse a pooled Paramiko connection instead of spawning scp
+    if ssh_pool.enabled():
+        return ssh_pool.sftp_get_file(
+            ip, ssh_key_path, remote_path, local_path, timeout, expected_size
+        )
     
+    temp_path = None
     try:
-        # Use SCP to copy the file
-        result = subprocess.run(
-            ["scp", "-i", ssh_key_path, 
-             "-o", f"ConnectTimeout={timeout}", 
-             "-o", "StrictHostKeyChecking=no",
-             f"root@{ip}:{remote_path}", temp_path],
-            check=False, capture_output=True
+        # Download next to local_path, so the finished file can be renamed
+        # into place instead of copied
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(local_path)}.", dir=os.path.dirname(local_path) or "."
         )
+        os.close(fd)
+        
+        if asyncssh is not None:
+            # Use SFTP with pipelined block requests, on a connection shared
+            # with earlier and concurrent calls for the same server
+            copied = _sftp_get_blocking(ip, ssh_key_path, remote_path, temp_path, timeout)
+        else:
+            # Use SCP to copy the file, retrying if the connection failed
+            for retry_delay in (*RETRY_BACKOFF, None):
+                result = subprocess.run(
+                    [_executable("scp"), *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_mux_opts(),
+                     f"root@{ip}:{remote_path}", temp_path],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False, close_fds=False
+                )
+                if (result.returncode == 0 or retry_delay is None
+                        or not _is_transient(result.returncode, result.stderr)):
+                    break
+                logger.warning(
+                    "Connection to %s failed, retrying in %.1fs: %s",
+                    ip, retry_delay, result.stderr.decode('utf-8', errors='replace').strip()
+                )
+                time.sleep(retry_delay)
+            copied = result.returncode == 0
         
         # Check if file was successfully copied
-        if result.returncode == 0 and os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-            shutil.copy(temp_path, local_path)
+        if copied and _has_expected_size(temp_path, expected_size):
+            os.replace(temp_path, local_path)
+            temp_path = None
             return True
         return False
     except Exception as e:
-        print(f"Error copying file from {ip}:{remote_path}: {e}")
+        logger.error("Error copying file from %s:%s: %s", ip, remote_path, e)
+        return False
+    finally:
+        # Clean up temp file if it was not renamed into place
+        if temp_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+
+def scp_get_files_tar(
+    ip: str,
+    ssh_key_path: str,
+    remote_paths: List[str],
+    local_dir: str,
+    timeout: int = 30
+) -> bool:
+    """
+    Copy several files from remote server as one tar stream over SSH.
+    
+    The remote tar is piped straight into a local tar, so all files share
+    one SSH session and one continuous TCP flow instead of paying the
+    per-file overhead of separate copies. Like scp with a directory target,
+    each file is saved in local_dir under its base name. The files are
+    extracted into a temporary directory inside local_dir and moved into
+    place only once the whole transfer succeeded, so on failure local_dir is
+    left as it was.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        remote_paths: Absolute paths of files on remote server
+        local_dir: Local directory to save the files in
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        True if all files were copied successfully, False otherwise
+    """
+    if not remote_paths:
+        return True
+    
+    # Change into each file's directory, so the archive holds base names
+    members = " ".join(
+        f"-C {shlex.quote(os.path.dirname(path) or '/')} {shlex.quote(os.path.basename(path))}"
+        for path in remote_paths
+    )
+    
+    extract_dir = None
+    try:
+        os.makedirs(local_dir, exist_ok=True)
+        extract_dir = tempfile.mkdtemp(prefix=".tar.", dir=local_dir)
+        # Both stderr streams go to files, so plenty of warnings from either
+        # tar cannot fill a pipe nobody reads while the stream is running
+        with tempfile.TemporaryFile() as sender_err, tempfile.TemporaryFile() as receiver_err:
+            sender = subprocess.Popen(
+                [_executable("ssh"), *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_mux_opts(),
+                 f"root@{ip}", f"tar -cf - {members}"],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=sender_err,
+                close_fds=False
+            )
+            receiver = subprocess.Popen(
+                [_executable("tar"), "-xf", "-", "-C", extract_dir],
+                stdin=sender.stdout, stdout=subprocess.DEVNULL, stderr=receiver_err,
+                close_fds=False
+            )
+            # Only the receiver reads the stream; closing our copy lets the
+            # sender see a broken pipe if the receiver exits early
+            sender.stdout.close()
+            receiver.wait()
+            sender.wait()
+            
+            if sender.returncode != 0 or receiver.returncode != 0:
+                sender_err.seek(0)
+                receiver_err.seek(0)
+                err = (sender_err.read() + receiver_err.read()).decode(errors='replace').strip()
+                logger.error("Error copying files from %s:%s: %s", ip, ", ".join(remote_paths), err)
+                return False
+        
+        for path in remote_paths:
+            name = os.path.basename(path)
+            os.replace(os.path.join(extract_dir, name), os.path.join(local_dir, name))
+        return True
+    except Exception as e:
+        logger.error("Error copying files from %s:%s: %s", ip, ", ".join(remote_paths), e)
         return False
     finally:
-        # Clean up temp file
-        if os.path.exists(temp_path):
+        if extract_dir:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+def ssh_put_file(
+    ip: str,
+    ssh_key_path: str,
+    local_path: str,
+    remote_path: str,
+    timeout: int = 30
+) -> bool:
+    """
+    Copy a file to remote server by streaming it over SSH.
+    
+    The local file is fed directly to the ssh process's stdin and written to a
+    temporary file next to remote_path, which is then renamed into place. The
+    remote directory is created if needed. Everything happens in one SSH
+    command and without a local temporary copy.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        local_path: Path to file locally
+        remote_path: Path to save file on remote server
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        True if file was copied successfully, False otherwise
+    """
+    remote_dir = shlex.quote(os.path.dirname(remote_path) or "/")
+    tmp_path = shlex.quote(f"{remote_path}.vps-ibr-tmp")
+    command = (
+        f"mkdir -p {remote_dir} && cat > {tmp_path} && "
+        f"mv -f {tmp_path} {shlex.quote(remote_path)}"
+    )
+    
+    try:
+        with open(local_path, 'rb') as f:
+            result = subprocess.run(
+                [_executable("ssh"), *_ssh_opts(ip, ssh_key_path, timeout), *_ssh_mux_opts(),
+                 f"root@{ip}", command],
+                stdin=f, capture_output=True, check=False, close_fds=False
+            )
+        
+        if result.returncode != 0:
+            logger.error(
+                "Error copying file to %s:%s: %s",
+                ip, remote_path, result.stderr.decode(errors='replace').strip()
+            )
+            return False
+        return True
+    except Exception as e:
+        logger.error("Error copying file to %s:%s: %s", ip, remote_path, e)
+        return False
+
+def _rsync_ssh_opts(ip: str, ssh_key_path: str, timeout: int, cipher: str = DEFAULT_CIPHER) -> str:
+    """Return the remote shell command rsync should use to reach ip."""
+    return " ".join(
+        [_executable("ssh"), *_ssh_opts(ip, ssh_key_path, timeout),
+         *_ssh_cipher_opts(cipher), *_ssh_mux_opts()]
+    )
+
+# Directory, relative to each destination directory, where interrupted
+# transfers keep their partial files until the next run resumes them
+RSYNC_PARTIAL_DIR = ".rsync-partial"
+
+# Longer exclude lists are written to a file and passed with --exclude-from,
+# keeping the command line short
+MAX_EXCLUDE_ARGS = 32
+
+def _rsync_base_command(
+    whole_file: bool,
+    compress: Optional[int],
+    resumable: bool,
+    verbose: bool,
+    bwlimit: Optional[str] = None,
+    numeric_ids: bool = True,
+    partial_dir: str = RSYNC_PARTIAL_DIR
+) -> List[str]:
+    """
+    Return the rsync command and transfer flags shared by all rsync calls.
+    
+    Args:
+        whole_file: Send changed files whole (-W) instead of computing deltas
+        compress: Compression level (-z), or None to transfer uncompressed
+        resumable: Keep partially transferred files in partial_dir
+        verbose: List transferred files and report progress and statistics
+        bwlimit: Optional bandwidth limit passed to rsync --bwlimit (e.g. "5m")
+        numeric_ids: Keep owners as numeric IDs instead of mapping them by name
+        partial_dir: Directory for partial files, relative to each destination
+        
+    Returns:
+        Command list to extend with call-specific options
+    """
+    command = [_executable("rsync"), "-a", "--delete", "--no-motd"]
+    if verbose:
+        command.append("-v")
+    if whole_file:
+        command.append("-W")
+    if numeric_ids:
+        command.append("--numeric-ids")
+    if compress is not None:
+        command.extend(["-z", f"--compress-level={compress}"])
+    if bwlimit:
+        command.append(f"--bwlimit={bwlimit}")
+    if resumable:
+        # Files are still written to a temporary file and renamed into
+        # place, so an interrupted run never leaves a half-written file at
+        # its destination
+        command.extend(["--partial", f"--partial-dir={partial_dir}"])
+    if verbose:
+        command.append("--info=stats2,progress2")
+    return command
+
+@contextlib.contextmanager
+def _rsync_exclude_opts(
+    exclude: Optional[List[str]], exclude_from: Optional[str]
+) -> Iterator[List[str]]:
+    """
+    Provide the rsync options that exclude the given patterns.
+    
+    Up to MAX_EXCLUDE_ARGS patterns are passed as --exclude arguments. A
+    longer list is written to a temporary file, passed with --exclude-from
+    and removed again when the context exits.
+    
+    Args:
+        exclude: List of patterns to exclude
+        exclude_from: Path of a file with more patterns to exclude, one per line
+        
+    Yields:
+        Options to add to the rsync command
+    """
+    opts = []
+    temp_path = None
+    try:
+        if exclude and len(exclude) > MAX_EXCLUDE_ARGS:
+            fd, temp_path = tempfile.mkstemp(prefix="vps-ibr-exclude-")
+            with os.fdopen(fd, "w") as f:
+                f.writelines(f"{pattern}\n" for pattern in exclude)
+            opts.append(f"--exclude-from={temp_path}")
+        elif exclude:
+            for pattern in exclude:
+                opts.extend(["--exclude", pattern])
+        if exclude_from:
+            opts.append(f"--exclude-from={exclude_from}")
+        yield opts
+    finally:
+        if temp_path:
             os.unlink(temp_path)
 
+def _run_rsync(
+    command: List[str], verbose: bool, file_list: Optional[str] = None
+) -> Tuple[int, str]:
+    """
+    Run rsync and return its exit status and error output.
+    
+    rsync's stdout is discarded, so a large tree is not buffered and decoded
+    for nothing; only stderr is kept for error reporting. In verbose mode
+    both go to the console instead, where rsync can redraw its progress line.
+    
+    Args:
+        command: rsync command line
+        verbose: Let rsync write to the console
+        file_list: File list fed to stdin, for --files-from=-
+        
+    Returns:
+        Tuple of the exit status and the stderr text (empty in verbose mode)
+    """
+    result = subprocess.run(
+        command,
+        input=file_list.encode() if file_list is not None else None,
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.PIPE,
+        check=False, close_fds=False
+    )
+    return result.returncode, (result.stderr or b"").decode(errors='replace').strip()
+
 def rsync_pull(
     ip: str,
     ssh_key_path: str,
     remote_path: str,
     local_path: str,
     exclude: List[str] = None,
-    timeout: int = 30
+    timeout: int = 30,
+    bwlimit: Optional[str] = None,
+    include: List[str] = None,
+    whole_file: bool = True,
+    compress: Optional[int] = None,
+    resumable: bool = True,
+    verbose: bool = False,
+    cipher: str = DEFAULT_CIPHER,
+    exclude_from: Optional[str] = None,
+    numeric_ids: bool = True,
+    partial_dir: str = RSYNC_PARTIAL_DIR
 ) -> bool:
     """
     Sync a directory from remote server using rsync.
@@ -109,38 +1381,155 @@ def rsync_pull(
         local_path: Path to save directory locally
         exclude: List of patterns to exclude
         timeout: Timeout in seconds for the SSH connection
+        bwlimit: Optional bandwidth limit passed to rsync --bwlimit (e.g. "5m")
+        include: If given, only paths matching these patterns are synced; they
+            are applied after exclude, so exclude still takes precedence
+        whole_file: Send changed files whole instead of computing deltas,
+            which is faster unless the link is much slower than the disks
+        compress: Compression level (e.g. 2) for slow links; by default
+            files are sent uncompressed, as compressing costs more than it
+            saves on fast links
+        resumable: Keep partially transferred files of an interrupted run,
+            so the next run resumes them instead of starting over
+        verbose: List transferred files and show rsync's progress and
+            statistics on the console
+        cipher: Preferred SSH cipher (see DEFAULT_CIPHER); an already open
+            master connection keeps the cipher it was started with
+        exclude_from: Path of a file with more patterns to exclude, one per line;
+            long exclude lists are passed to rsync the same way
+        numeric_ids: Keep file owners as numeric user and group IDs instead of
+            mapping them by name, which skips the name lookups on both ends
+        partial_dir: Directory, relative to each destination directory, where
+            resumable transfers keep their partial files
         
     Returns:
         True if directory was synced successfully, False otherwise
     """
     try:
         # Build rsync command
-        command = ["rsync", "-avz", "--delete"]
+        command = _rsync_base_command(
+            whole_file, compress, resumable, verbose, bwlimit, numeric_ids, partial_dir
+        )
         
         # Add SSH options
-        ssh_opts = f"ssh -i {ssh_key_path} -o ConnectTimeout={timeout} -o StrictHostKeyChecking=no"
-        command.extend(["-e", ssh_opts])
+        command.extend(["-e", _rsync_ssh_opts(ip, ssh_key_path, timeout, cipher)])
         
         # Add exclude patterns
-        if exclude:
-            for pattern in exclude:
-                command.extend(["--exclude", pattern])
-        
-        # Add source and destination
-        command.append(f"root@{ip}:{remote_path}")
-        command.append(local_path)
-        
-        # Run rsync
-        result = subprocess.run(
-            command,
-            check=False,
-            capture_output=True,
-            text=True
-        )
+        with _rsync_exclude_opts(exclude, exclude_from) as exclude_opts:
+            command.extend(exclude_opts)
+            
+            # Add include patterns, excluding everything they do not match
+            if include:
+                for pattern in include:
+                    command.extend(["--include", pattern])
+                command.extend(["--exclude", "*"])
+            
+            # Add source and destination
+            command.append(f"root@{ip}:{remote_path}")
+            command.append(local_path)
+            
+            # Run rsync
+            returncode, stderr = _run_rsync(command, verbose)
+        if returncode != 0:
+            logger.error(
+                "Error rsyncing from %s:%s: exit status %d: %s",
+                ip, remote_path, returncode, stderr
+            )
+        return returncode == 0
+    except Exception as e:
+        logger.error("Error rsyncing from %s:%s: %s", ip, remote_path, e)
+        return False
+
+def rsync_pull_many(
+    ip: str,
+    ssh_key_path: str,
+    remote_paths: List[str],
+    local_root: str,
+    exclude: List[str] = None,
+    timeout: int = 30,
+    bwlimit: Optional[str] = None,
+    whole_file: bool = True,
+    compress: Optional[int] = None,
+    resumable: bool = True,
+    verbose: bool = False,
+    cipher: str = DEFAULT_CIPHER,
+    exclude_from: Optional[str] = None,
+    numeric_ids: bool = True,
+    partial_dir: str = RSYNC_PARTIAL_DIR
+) -> bool:
+    """
+    Sync several directories from remote server in a single rsync run.
+    
+    The paths are passed to rsync with --files-from, so all of them share one
+    SSH connection and one file-list exchange. Each path keeps its location
+    relative to / under local_root (e.g. /etc/ is stored in local_root/etc/).
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        remote_paths: Absolute paths of directories on remote server
+        local_root: Local directory mirroring the remote /
+        exclude: List of patterns to exclude
+        timeout: Timeout in seconds for the SSH connection
+        bwlimit: Optional bandwidth limit passed to rsync --bwlimit (e.g. "5m")
+        whole_file: Send changed files whole instead of computing deltas,
+            which is faster unless the link is much slower than the disks
+        compress: Compression level (e.g. 2) for slow links; by default
+            files are sent uncompressed, as compressing costs more than it
+            saves on fast links
+        resumable: Keep partially transferred files of an interrupted run,
+            so the next run resumes them instead of starting over
+        verbose: List transferred files and show rsync's progress and
+            statistics on the console
+        cipher: Preferred SSH cipher (see DEFAULT_CIPHER); an already open
+            master connection keeps the cipher it was started with
+        exclude_from: Path of a file with more patterns to exclude, one per line;
+            long exclude lists are passed to rsync the same way
+        numeric_ids: Keep file owners as numeric user and group IDs instead of
+            mapping them by name, which skips the name lookups on both ends
+        partial_dir: Directory, relative to each destination directory, where
+            resumable transfers keep their partial files
+        
+    Returns:
+        True if all directories were synced successfully, False otherwise
+    """
+    if not remote_paths:
+        return True
+    
+    try:
+        # -a does not imply -r together with --files-from. --files-from
+        # implies --relative, which would also send the parent directories of
+        # each path (e.g. /var for /var/spool/cron/) with the attributes they
+        # have on the source; --no-implied-dirs leaves them alone
+        command = [
+            *_rsync_base_command(
+                whole_file, compress, resumable, verbose, bwlimit, numeric_ids, partial_dir
+            ),
+            "-r", "--files-from=-", "--no-implied-dirs"
+        ]
         
-        return result.returncode == 0
+        # Add SSH options
+        command.extend(["-e", _rsync_ssh_opts(ip, ssh_key_path, timeout, cipher)])
+        
+        # Add exclude patterns
+        with _rsync_exclude_opts(exclude, exclude_from) as exclude_opts:
+            command.extend(exclude_opts)
+            
+            # Add source root and destination; the file list is read from stdin
+            command.append(f"root@{ip}:/")
+            command.append(local_root)
+            file_list = "".join(f"{path.lstrip('/')}\n" for path in remote_paths)
+            
+            # Run rsync
+            returncode, stderr = _run_rsync(command, verbose, file_list)
+        if returncode != 0:
+            logger.error(
+                "Error rsyncing from %s:%s: exit status %d: %s",
+                ip, ", ".join(remote_paths), returncode, stderr
+            )
+        return returncode == 0
     except Exception as e:
-        print(f"Error rsyncing from {ip}:{remote_path}: {e}")
+        logger.error("Error rsyncing from %s:%s: %s", ip, ", ".join(remote_paths), e)
         return False
 
 def rsync_push(
@@ -149,7 +1538,16 @@ def rsync_push(
     local_path: str,
     remote_path: str,
     exclude: List[str] = None,
-    timeout: int = 30
+    timeout: int = 30,
+    bwlimit: Optional[str] = None,
+    whole_file: bool = True,
+    compress: Optional[int] = None,
+    resumable: bool = True,
+    verbose: bool = False,
+    cipher: str = DEFAULT_CIPHER,
+    exclude_from: Optional[str] = None,
+    numeric_ids: bool = True,
+    partial_dir: str = RSYNC_PARTIAL_DIR
 ) -> bool:
     """
     Sync a directory to remote server using rsync.
@@ -161,36 +1559,242 @@ def rsync_push(
         remote_path: Path to save directory on remote server
         exclude: List of patterns to exclude
         timeout: Timeout in seconds for the SSH connection
+        bwlimit: Optional bandwidth limit passed to rsync --bwlimit (e.g. "5m")
+        whole_file: Send changed files whole instead of computing deltas,
+            which is faster unless the link is much slower than the disks
+        compress: Compression level (e.g. 2) for slow links; by default
+            files are sent uncompressed, as compressing costs more than it
+            saves on fast links
+        resumable: Keep partially transferred files of an interrupted run,
+            so the next run resumes them instead of starting over
+        verbose: List transferred files and show rsync's progress and
+            statistics on the console
+        cipher: Preferred SSH cipher (see DEFAULT_CIPHER); an already open
+            master connection keeps the cipher it was started with
+        exclude_from: Path of a file with more patterns to exclude, one per line;
+            long exclude lists are passed to rsync the same way
+        numeric_ids: Keep file owners as numeric user and group IDs instead of
+            mapping them by name, which skips the name lookups on both ends
+        partial_dir: Directory, relative to each destination directory, where
+            resumable transfers keep their partial files
         
     Returns:
         True if directory was synced successfully, False otherwise
     """
     try:
         # Build rsync command
-        command = ["rsync", "-avz", "--delete"]
+        command = _rsync_base_command(
+            whole_file, compress, resumable, verbose, bwlimit, numeric_ids, partial_dir
+        )
         
         # Add SSH options
-        ssh_opts = f"ssh -i {ssh_key_path} -o ConnectTimeout={timeout} -o StrictHostKeyChecking=no"
-        command.extend(["-e", ssh_opts])
+        command.extend(["-e", _rsync_ssh_opts(ip, ssh_key_path, timeout, cipher)])
         
         # Add exclude patterns
-        if exclude:
-            for pattern in exclude:
-                command.extend(["--exclude", pattern])
-        
-        # Add source and destination
-        command.append(local_path)
-        command.append(f"root@{ip}:{remote_path}")
-        
-        # Run rsync
-        result = subprocess.run(
-            command,
-            check=False,
-            capture_output=True,
-            text=True
-        )
+        with _rsync_exclude_opts(exclude, exclude_from) as exclude_opts:
+            command.extend(exclude_opts)
+            
+            # Add source and destination
+            command.append(local_path)
+            command.append(f"root@{ip}:{remote_path}")
+            
+            # Run rsync
+            returncode, stderr = _run_rsync(command, verbose)
+        if returncode != 0:
+            logger.error(
+                "Error rsyncing to %s:%s: exit status %d: %s",
+                ip, remote_path, returncode, stderr
+            )
+        return returncode == 0
+    except Exception as e:
+        logger.error("Error rsyncing to %s:%s: %s", ip, remote_path, e)
+        return False
+
+def rsync_push_many(
+    ip: str,
+    ssh_key_path: str,
+    local_root: str,
+    paths: List[str],
+    remote_root: str = "/",
+    exclude: List[str] = None,
+    timeout: int = 30,
+    bwlimit: Optional[str] = None,
+    whole_file: bool = True,
+    compress: Optional[int] = None,
+    resumable: bool = True,
+    verbose: bool = False,
+    cipher: str = DEFAULT_CIPHER,
+    exclude_from: Optional[str] = None,
+    numeric_ids: bool = True,
+    partial_dir: str = RSYNC_PARTIAL_DIR
+) -> bool:
+    """
+    Sync several directories to remote server in a single rsync run.
+    
+    The paths are passed to rsync with --files-from, so all of them share one
+    SSH connection and one file-list exchange. Each path keeps its location
+    relative to local_root under remote_root (e.g. with local_root system/,
+    the path etc/ is restored to /etc/).
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        local_root: Local directory the paths are relative to
+        paths: Paths of directories below local_root
+        remote_root: Directory on remote server mirroring local_root
+        exclude: List of patterns to exclude
+        timeout: Timeout in seconds for the SSH connection
+        bwlimit: Optional bandwidth limit passed to rsync --bwlimit (e.g. "5m")
+        whole_file: Send changed files whole instead of computing deltas,
+            which is faster unless the link is much slower than the disks
+        compress: Compression level (e.g. 2) for slow links; by default
+            files are sent uncompressed, as compressing costs more than it
+            saves on fast links
+        resumable: Keep partially transferred files of an interrupted run,
+            so the next run resumes them instead of starting over
+        verbose: List transferred files and show rsync's progress and
+            statistics on the console
+        cipher: Preferred SSH cipher (see DEFAULT_CIPHER); an already open
+            master connection keeps the cipher it was started with
+        exclude_from: Path of a file with more patterns to exclude, one per line;
+            long exclude lists are passed to rsync the same way
+        numeric_ids: Keep file owners as numeric user and group IDs instead of
+            mapping them by name, which skips the name lookups on both ends
+        partial_dir: Directory, relative to each destination directory, where
+            resumable transfers keep their partial files
+        
+    Returns:
+        True if all directories were synced successfully, False otherwise
+    """
+    if not paths:
+        return True
+    
+    try:
+        # -a does not imply -r together with --files-from. --files-from
+        # implies --relative, which would also send the parent directories of
+        # each path (e.g. /var for /var/spool/cron/) with the attributes they
+        # have on the source; --no-implied-dirs leaves them alone
+        command = [
+            *_rsync_base_command(
+                whole_file, compress, resumable, verbose, bwlimit, numeric_ids, partial_dir
+            ),
+            "-r", "--files-from=-", "--no-implied-dirs"
+        ]
         
-        return result.returncode == 0
+        # Add SSH options
+        command.extend(["-e", _rsync_ssh_opts(ip, ssh_key_path, timeout, cipher)])
+        
+        # Add exclude patterns
+        with _rsync_exclude_opts(exclude, exclude_from) as exclude_opts:
+            command.extend(exclude_opts)
+            
+            # Add source root and destination; the file list is read from stdin
+            command.append(f"{local_root.rstrip('/')}/")
+            command.append(f"root@{ip}:{remote_root}")
+            file_list = "".join(f"{path.lstrip('/')}\n" for path in paths)
+            
+            # Run rsync
+            returncode, stderr = _run_rsync(command, verbose, file_list)
+        if returncode != 0:
+            logger.error(
+                "Error rsyncing to %s:%s: exit status %d: %s",
+                ip, remote_root, returncode, stderr
+            )
+        return returncode == 0
     except Exception as e:
-        print(f"Error rsyncing to {ip}:{remote_path}: {e}")
-        return False
\ No newline at end of file
+        logger.error("Error rsyncing to %s:%s: %s", ip, remote_root, e)
+        return False
+
+class SSHSession:
+    """
+    SSH connection to a single server, shared by every command and copy.
+    
+    Opening a session starts an SSH master connection (see
+    open_master_connection); run and get_file are multiplexed over it, so
+    only the first call pays for the TCP handshake and authentication. If the
+    master cannot be started up front, the first call starts it instead.
+    
+    Usage:
+        with SSHSession(ip, ssh_key_path) as session:
+            output = session.run("uname -a")
+    """
+    
+    def __init__(self, ip: str, ssh_key_path: str, timeout: int = 30):
+        """
+        Open a session to a server.
+        
+        Args:
+            ip: Server IP address
+            ssh_key_path: Path to SSH key file
+            timeout: Timeout in seconds for the SSH connection
+        """
+        self.ip = ip
+        self.ssh_key_path = ssh_key_path
+        self.timeout = timeout
+        self._run = make_ssh_runner(ip, ssh_key_path, timeout)
+        self._closed = False
+        open_master_connection(ip, ssh_key_path, timeout)
+    
+    def run(self, command: str, binary: bool = False) -> Optional[Union[str, bytes]]:
+        """
+        Run a command on the server and return its output.
+        
+        Args:
+            command: Command to execute on the remote server
+            binary: Return the raw, unstripped output bytes instead of text
+            
+        Returns:
+            Command output as string (bytes if binary), or None if command failed
+        """
+        return self._run(command, binary)
+    
+    def get_file(
+        self, remote_path: str, local_path: str, expected_size: Optional[int] = None
+    ) -> bool:
+        """
+        Copy a file from the server.
+        
+        Args:
+            remote_path: Path to file on remote server
+            local_path: Path to save file locally
+            expected_size: Size of the remote file, if known (see scp_get_file)
+            
+        Returns:
+            True if file was copied successfully, False otherwise
+        """
+        return scp_get_file(
+            self.ip, self.ssh_key_path, remote_path, local_path, self.timeout, expected_size
+        )
+    
+    def open_stream(self, command: str) -> subprocess.Popen:
+        """
+        Start a command on the server and return the running process.
+        
+        The output is available as a binary stream on the process's stdout,
+        so large outputs can be consumed while they arrive. The caller closes
+        stdout and waits for the process.
+        
+        Args:
+            command: Command to execute on the remote server
+            
+        Returns:
+            The ssh process
+        """
+        return subprocess.Popen(
+            [_executable("ssh"), *_ssh_opts(self.ip, self.ssh_key_path, self.timeout),
+             *_ssh_mux_opts(), f"root@{self.ip}", command],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            close_fds=False
+        )
+    
+    def close(self) -> None:
+        """Release the master connection of the session (see close_mux)."""
+        if not self._closed:
+            self._closed = True
+            close_mux(self.ip)
+    
+    def __enter__(self) -> "SSHSession":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
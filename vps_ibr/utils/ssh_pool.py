@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Pooled Paramiko SSH connections for VPS Inventory, Backup & Restore.
+
+When VPS_IBR_USE_PARAMIKO=1 is set, run_ssh_command and scp_get_file in
+vps_ibr.utils.ssh run over one authenticated Paramiko transport per server
+instead of spawning an ssh or scp process per call.
+"""
+import os
+import atexit
+import contextlib
+import socket
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional, Union, Tuple
+
+# SSH failures on pooled connections, one record each with the server it concerns
+logger = logging.getLogger(__name__)
+
+# At most this many connections are kept open; the least recently used one is
+# closed to make room
+MAX_CLIENTS = 64
+
+# Open clients by (ip, ssh_key_path), least recently used first
+_clients: Dict[Tuple[str, str], "paramiko.SSHClient"] = {}
+_clients_lock = threading.Lock()
+
+# One lock per server, so concurrent first calls share a single connection
+# while different servers still connect in parallel
+_connect_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+# Bytes read from a command's stdout or stderr at a time
+_READ_CHUNK = 65536
+
+def enabled() -> bool:
+    """Return True if SSH calls should go through the Paramiko pool."""
+    return os.environ.get("VPS_IBR_USE_PARAMIKO") == "1"
+
+def _get_client(ip: str, ssh_key_path: str, timeout: int = 30) -> "paramiko.SSHClient":
+    """
+    Return the pooled client for a server, connecting it if needed.
+    
+    A client whose transport has dropped is replaced by a new connection.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        timeout: Timeout in seconds for the SSH connection
+        
+    Returns:
+        Connected client logged in as root
+    """
+    # Imported here so the default subprocess path does not load paramiko
+    import paramiko
+    
+    key = (ip, ssh_key_path)
+    with _clients_lock:
+        connect_lock = _connect_locks.setdefault(key, threading.Lock())
+    
+    with connect_lock:
+        with _clients_lock:
+            client = _clients.pop(key, None)
+            if client is not None:
+                _clients[key] = client
+        
+        transport = client.get_transport() if client is not None else None
+        if transport is not None and transport.is_active():
+            return client
+        if client is not None:
+            client.close()
+        
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        # Same as StrictHostKeyChecking=no for the ssh command line
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            ip, username="root", key_filename=ssh_key_path, timeout=timeout,
+            banner_timeout=timeout, auth_timeout=timeout
+        )
+        
+        with _clients_lock:
+            _clients[key] = client
+            evicted = []
+            while len(_clients) > MAX_CLIENTS:
+                evicted.append(_clients.pop(next(iter(_clients))))
+        for old_client in evicted:
+            old_client.close()
+        return client
+
+def run_ssh_command(
+    ip: str,
+    ssh_key_path: str,
+    command: str,
+    timeout: int = 30,
+    binary: bool = False,
+    input: Optional[str] = None,
+    max_output_bytes: Optional[int] = None
+) -> Optional[Union[str, bytes]]:
+    """
+    Run a command on remote server over the pooled connection and return output.
+    
+    As with the ssh command line, the timeout only applies to connecting; a
+    command may run, and stay silent, for as long as it needs.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        command: Command to execute on the remote server
+        timeout: Timeout in seconds for the SSH connection
+        binary: Return the raw, unstripped output bytes instead of text
+        input: Text fed to the command's stdin
+        max_output_bytes: Stop the command and fail once its stdout and
+            stderr together exceed this many bytes; no limit if None
+        
+    Returns:
+        Command output as string (bytes if binary), or None if command failed
+    """
+    client = None
+    try:
+        client = _get_client(ip, ssh_key_path, timeout)
+        stdin, stdout, stderr = client.exec_command(command)
+        if input is not None:
+            stdin.write(input.encode())
+        # Closing stdin sends EOF to the command
+        stdin.close()
+        
+        # Drain stderr alongside stdout, so a command writing a lot to stderr
+        # cannot stall on a full channel window; both count towards the limit
+        output = (bytearray(), bytearray())
+        total = 0
+        too_large = False
+        lock = threading.Lock()
+        
+        def read(stream, buffer: bytearray) -> None:
+            nonlocal total, too_large
+            while True:
+                chunk = stream.read(_READ_CHUNK)
+                if not chunk:
+                    return
+                with lock:
+                    total += len(chunk)
+                    if max_output_bytes is not None and total > max_output_bytes:
+                        too_large = True
+                        # Closing the channel stops the command and ends both reads
+                        stream.channel.close()
+                        return
+                    buffer += chunk
+        
+        err_reader = threading.Thread(target=read, args=(stderr, output[1]), daemon=True)
+        err_reader.start()
+        read(stdout, output[0])
+        err_reader.join()
+        if too_large:
+            logger.error(
+                "Error executing command on %s: output exceeded %d bytes, command killed",
+                ip, max_output_bytes
+            )
+            return None
+        returncode = stdout.channel.recv_exit_status()
+        
+        out, err = bytes(output[0]), bytes(output[1])
+        if returncode != 0:
+            logger.error(
+                "Error executing command on %s: "
+                "Command returned non-zero exit status %d.\nstderr: %s",
+                ip, returncode, err.decode(errors='replace')
+            )
+            return None
+        if binary:
+            return out
+        return out.decode(errors='replace').strip()
+    except (socket.timeout, TimeoutError):
+        # socket.timeout only became an alias of TimeoutError in Python 3.10;
+        # once connected, a timeout comes from the command's channel instead
+        if client is None:
+            logger.error("Timeout while connecting to %s", ip)
+        else:
+            logger.error("Timeout while executing command on %s", ip)
+        return None
+    except Exception as e:
+        logger.error("Unexpected error while executing command on %s: %s", ip, e)
+        return None
+
+def sftp_get_file(
+    ip: str,
+    ssh_key_path: str,
+    remote_path: str,
+    local_path: str,
+    timeout: int = 30,
+    expected_size: Optional[int] = None
+) -> bool:
+    """
+    Copy a file from remote server over SFTP on the pooled connection.
+    
+    Like scp_get_file, local_path is only written if the remote file exists
+    and is not empty, or has expected_size if given; the file is downloaded
+    next to it and renamed into place, so it is never left half-written.
+    
+    Args:
+        ip: Server IP address
+        ssh_key_path: Path to SSH key file
+        remote_path: Path to file on remote server
+        local_path: Path to save file locally
+        timeout: Timeout in seconds for the SSH connection
+        expected_size: Size of the remote file, if known
+        
+    Returns:
+        True if file was copied successfully, False otherwise
+    """
+    temp_path = None
+    try:
+        client = _get_client(ip, ssh_key_path, timeout)
+        sftp = client.open_sftp()
+        try:
+            if expected_size is None and sftp.stat(remote_path).st_size == 0:
+                return False
+            fd, temp_path = tempfile.mkstemp(
+                prefix=f".{os.path.basename(local_path)}.", dir=os.path.dirname(local_path) or "."
+            )
+            os.close(fd)
+            sftp.get(remote_path, temp_path)
+        finally:
+            sftp.close()
+        if expected_size is not None and os.stat(temp_path).st_size != expected_size:
+            return False
+        os.replace(temp_path, local_path)
+        temp_path = None
+        return True
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error("Error copying file from %s:%s: %s", ip, remote_path, e)
+        return False
+    finally:
+        # Clean up temp file if it was not renamed into place
+        if temp_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+
+@atexit.register
+def close_all() -> None:
+    """Close every pooled connection."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()